@@ -1,39 +1,149 @@
-import os, uuid, re
-from flask import Flask, render_template, request, jsonify, session, make_response, flash, redirect, url_for
-from werkzeug.security import generate_password_hash, check_password_hash
+import os, io, csv, uuid, re, sys, time, json, zlib, sqlite3, mimetypes, subprocess
+import click
+from datetime import datetime, timezone
+from flask import Flask, Response, render_template, request, jsonify, session, make_response, flash, redirect, url_for, send_from_directory, abort
+from werkzeug.security import generate_password_hash
+from werkzeug.utils import safe_join
 
 from utils import (
-    get_db, init_db,
+    get_db, init_db, release_db, explain_hot_queries, encode_cursor, decode_cursor,
+    has_message_fts, fts_query, rebuild_stats, read_stats, where_clause, delete_chat_message,
+    ADMIN_MESSAGES_QUERY, ADMIN_MESSAGES_AFTER, MESSAGE_FTS_FILTER,
+    MESSAGE_SEARCH_QUERY, MESSAGE_SEARCH_MATCH, MESSAGE_SEARCH_AFTER, ADMIN_BOOKINGS_QUERY, BOOKING_SORTS,
+    authenticate, LoginBusy, password_verifier, notices_cache, dashboard_json,
     role_required, admin_required, login_required,
-    bot_reply, load_intents,
-    create_employee, create_student
+    chat_pipeline, load_intents,
+    inference_engine, check_backend_parity, classify_batcher, classification_cache,
+    message_writer, archive_messages, archive_path, search_archive, MESSAGE_RETENTION_DAYS,
+    load_dense_layers, load_model_bundle,
+    MODEL_PATH, WORDS_PATH, CLASSES_PATH, BUNDLE_PATH,
+    create_employee, create_student, parse_people, provision_accounts, PROVISION_TABLES,
+    build_assets, asset_manifest, asset_url, asset_build, ASSET_DIR, ASSET_ENCODINGS
 )
 
 app = Flask(__name__)
 app.secret_key = os.environ.get('SECRET_KEY', 'SUPER SECRET KEY')
 
+# Pooled DB connections are handed back at the end of every request
+app.teardown_appcontext(release_db)
+
+# Batches the message writer gives up on, and model tier failures, go to the app log
+message_writer.logger = app.logger
+chat_pipeline.logger = app.logger
+
+# Templates link CSS/JS through asset_url() to pick up the fingerprinted builds
+app.add_template_global(asset_url)
+
 # Initialize DB (creates tables if missing)
 init_db()
 
+# The chatbot model (and TensorFlow) load lazily on first use.
+# Set UOK_PRELOAD_MODEL=1 to load and warm it up at startup instead.
+if os.environ.get('UOK_PRELOAD_MODEL') == '1':
+    try:
+        inference_engine.load()
+    except Exception as e:
+        app.logger.warning("Chatbot model not loaded: %s", e)
+
 # -----------------------------
 # Helper functions (message ops)
 # -----------------------------
-def insert_message(session_id, sender, content):
+def insert_message(session_id, sender, content, intent=None):
+    """Log one chat message through the write-behind message writer."""
+    message_writer.write([(session_id, sender, content, intent)])
+
+MESSAGE_LIMIT = 10
+LIMIT_REACHED_MESSAGE = f'You have reached the maximum of {MESSAGE_LIMIT} messages for this session.'
+SESSION_ENDED_NOTE = (f"\n\nThis was your {MESSAGE_LIMIT}th message. This session has now ended. "
+                      "Thank you for using ChatPy!")
+
+def session_message_count(session_id):
+    """User messages sent so far in a chat session, or None if the session does not exist."""
+    # Closed explicitly: the streaming reply calls this after the app context is gone,
+    # where nothing else would hand the connection back to the pool
     conn = get_db()
-    c = conn.cursor()
-    c.execute('INSERT INTO messages (session_id, sender, content) VALUES (?, ?, ?)',
-              (session_id, sender, content))
-    conn.commit()
+    row = conn.execute('SELECT user_message_count FROM sessions WHERE session_id = ?',
+                       (session_id,)).fetchone()
     conn.close()
-
-def count_session_messages(session_id, sender='user'):
+    return None if row is None else row[0]
+
+def record_chat_turn(session_id, user_message, bot_response, intent=None):
+    """
+    Record one chat turn: take a message from the session's quota with a conditional
+    UPDATE (so parallel requests cannot both get past the limit) and store the user
+    and bot messages.
+    With UOK_MESSAGE_DURABILITY=sync the messages are inserted in the same transaction
+    as the quota update, so a turn is stored whole or not at all. In the default async
+    mode only the quota update is committed here and the messages go to the
+    write-behind writer: a crash before its next flush (at most flush_ms later), or a
+    batch it has to drop, leaves the quota charged with the messages missing.
+    intent is the tag the user message was matched to (None for a fallback reply).
+    Returns (user_message_count, bot_response) after the turn, or None if the quota was used up.
+    """
     conn = get_db()
     c = conn.cursor()
-    c.execute('SELECT COUNT(*) FROM messages WHERE session_id = ? AND sender = ?',
-              (session_id, sender))
-    count = c.fetchone()[0]
-    conn.close()
-    return count
+    try:
+        c.execute('BEGIN IMMEDIATE')
+        c.execute('''UPDATE sessions SET user_message_count = user_message_count + 1
+                     WHERE session_id = ? AND user_message_count < ?''', (session_id, MESSAGE_LIMIT))
+        if c.rowcount == 0:
+            conn.rollback()
+            return None
+
+        count = c.execute('SELECT user_message_count FROM sessions WHERE session_id = ?',
+                          (session_id,)).fetchone()[0]
+        if count >= MESSAGE_LIMIT:
+            bot_response += SESSION_ENDED_NOTE
+        messages = [(session_id, 'user', user_message, intent),
+                    (session_id, 'bot', bot_response, None)]
+        if message_writer.durability == 'sync':
+            message_writer.write_in_transaction(conn, messages)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+    if message_writer.durability != 'sync':
+        message_writer.write(messages)
+    return count, bot_response
+
+# -----------------------------
+# Static assets (fingerprinted)
+# -----------------------------
+ASSET_MAX_AGE = 365 * 24 * 3600
+
+@app.route('/assets/<path:filename>')
+def assets(filename):
+    """
+    Serve a file written by `flask build-assets`. Names carry a content hash, so
+    they can be cached forever; the .br/.gz variant is sent when the client accepts it.
+    Only the hashed names in the current manifest (and their .br/.gz variants) are
+    served: anything else in the directory, manifest.json included, is a 404.
+    """
+    directory = os.path.abspath(ASSET_DIR)
+    hashed = set(asset_manifest().values())
+    if filename not in hashed:
+        if any(filename.endswith(variant) and filename[:-len(variant)] in hashed
+               for _, variant in ASSET_ENCODINGS):
+            # A precompressed variant asked for by name
+            return send_from_directory(directory, filename, max_age=ASSET_MAX_AGE)
+        abort(404)
+    mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+    encoding, suffix = None, ''
+    for name, variant in ASSET_ENCODINGS:
+        path = safe_join(directory, filename + variant)
+        if request.accept_encodings[name] > 0 and path and os.path.isfile(path):
+            encoding, suffix = name, variant
+            break
+
+    response = send_from_directory(directory, filename + suffix, mimetype=mimetype, max_age=ASSET_MAX_AGE)
+    if encoding:
+        response.content_encoding = encoding
+    response.vary.add('Accept-Encoding')
+    response.headers['Cache-Control'] = f'public, max-age={ASSET_MAX_AGE}, immutable'
+    return response
 
 # -----------------------------
 # Routes - UI
@@ -61,24 +171,20 @@ def login():
         username = request.form.get('username', '').strip()
         password = request.form.get('password', '').strip()
 
+        # One probe of the identities index (admin, employees and students), then
+        # the password check on the bounded verifier pool
         conn = get_db()
-        cursor = conn.cursor()
-
-        # Try to fetch user from admin, employees, or students
-        cursor.execute("""
-            SELECT id, fname, lname, email, 'admin' as role, password FROM admin WHERE email=?
-            UNION
-            SELECT id, fname, lname, email, role, password FROM employees WHERE email=?
-            UNION
-            SELECT id, fname, lname, email, role, password FROM students WHERE email=?
-        """, (username, username, username))
-
-        user = cursor.fetchone()
-        conn.close()
+        try:
+            user = authenticate(conn, username, password)
+        except LoginBusy:
+            flash("Too many sign-ins at the moment, please try again shortly", "danger")
+            return render_template("Login.html"), 503, {'Retry-After': '1'}
+        finally:
+            conn.close()
 
-        if user and check_password_hash(user['password'], password):
+        if user:
             # Store session
-            session['user_id'] = user['id']
+            session['user_id'] = user['user_id']
             session['user_role'] = user['role']
             session['full_name'] = f"{user['fname']} {user['lname']}"
 
@@ -104,25 +210,8 @@ def login():
 @app.route("/admin")
 @admin_required
 def admin_dashboard():
-    conn = get_db()
-    c = conn.cursor()
-
-    # Fetch bookings
-    c.execute("SELECT * FROM bookings ORDER BY created_at DESC")
-    bookings = [dict(row) for row in c.fetchall()]
-
-    # Fetch messages
-    c.execute("""
-        SELECT m.id, m.session_id, m.sender, m.content, m.timestamp, u.full_name
-        FROM messages m
-        LEFT JOIN sessions s ON m.session_id = s.session_id
-        LEFT JOIN users u ON s.user_id = u.id
-        ORDER BY m.timestamp DESC
-    """)
-    messages = [dict(row) for row in c.fetchall()]
-
-    conn.close()
-    return render_template("Admin.html", user=session, bookings=bookings, messages=messages)
+    # Messages and bookings are loaded page by page from the /api/admin/* endpoints
+    return render_template("Admin.html", user=session)
 
 @app.route('/employee')
 @role_required('employee')
@@ -134,29 +223,31 @@ def employee_dashboard():
     return render_template("Employees.html", user=user)
 
 @app.route('/student')
-@login_required
+@role_required('student')
 def student_dashboard():
     db = get_db()
-    user_id = session.get('user_id')
-
-    if not user_id:
-        flash("Please login to access your dashboard.")
-        return redirect(url_for('login'))
-
-    student = db.execute("SELECT * FROM students WHERE id = ?", (user_id,)).fetchone()
-    if not student:
+    dashboard = json.loads(dashboard_json(db, 'student', session['user_id']))
+    db.close()
+    if not dashboard['profile']:
         flash("Student not found.")
         return redirect(url_for('login'))
 
-    # Fetch bookings matching student's name
-    bookings = db.execute(
-        "SELECT * FROM bookings WHERE fname = ? AND lname = ? ORDER BY slot ASC", (student['fname'], student['lname'])
-    ).fetchall()
+    return render_template("Students.html", user=dashboard['profile'],
+                           bookings=dashboard['bookings'], notices=dashboard['notices'])
 
-    notices = db.execute("SELECT * FROM notices ORDER BY created_at DESC").fetchall()
-    db.close()
-
-    return render_template("Students.html", user=student, bookings=bookings, notices=notices)
+@app.route('/api/me/dashboard', methods=['GET'])
+@role_required('student', 'employee')
+def api_my_dashboard():
+    """Profile, upcoming bookings and notice headers for the logged-in user, from one query."""
+    conn = get_db()
+    payload = dashboard_json(conn, session['user_role'], session['user_id'])
+    conn.close()
+    if json.loads(payload)['profile'] is None:
+        return jsonify({'success': False, 'error': 'Account not found'}), 404
+    response = Response(payload, mimetype='application/json')
+    response.add_etag()
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response.make_conditional(request)
 
 # Update profile (student or employee)
 @app.route('/update_profile', methods=['POST'])
@@ -272,6 +363,73 @@ def api_delete_student(stu_id):
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
+# -----------------------------
+# Bulk provisioning (admin): many employees / students at once
+# -----------------------------
+CREDENTIAL_COLUMNS = ('id', 'fname', 'lname', 'email', 'password')
+
+def credentials_csv(accounts, reraise=False):
+    """
+    CSV text of the generated credentials, yielded in blocks as accounts are created.
+
+    The response is already under way when accounts are created, so a failure part
+    way cannot turn into an error status: it ends the CSV with a row whose id is
+    ERROR, saying how many accounts (the rows above it) were created before it.
+    With reraise=True the error is raised again after that row is yielded.
+    """
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=CREDENTIAL_COLUMNS)
+    writer.writeheader()
+    created = 0
+    try:
+        for account in accounts:
+            writer.writerow(account)
+            created += 1
+            if buffer.tell() >= 16384:
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+    except Exception as e:
+        app.logger.exception("Bulk provisioning stopped after %d accounts", created)
+        writer.writerow({'id': 'ERROR',
+                         'fname': f"Stopped after {created} accounts (the rows above were created): {e}"})
+        yield buffer.getvalue()
+        if reraise:
+            raise
+        return
+    yield buffer.getvalue()
+
+@app.route('/api/<any(employee, student):role>/bulk', methods=['POST'])
+@admin_required
+def api_bulk_provision(role):
+    """
+    Create accounts from an uploaded CSV/JSON file (form field 'file'), a JSON
+    list body, or a text/csv body; streams back the generated credentials as CSV.
+    Every record is validated before any account is created; a failure after that
+    leaves the accounts created so far and ends the CSV with an ERROR row.
+    """
+    upload = request.files.get('file')
+    if upload is not None:
+        text = upload.read().decode('utf-8-sig')
+        fmt = 'json' if upload.filename.lower().endswith('.json') else 'csv'
+    elif request.is_json:
+        text, fmt = request.get_data(as_text=True), 'json'
+    else:
+        text, fmt = request.get_data(as_text=True), 'csv'
+    fmt = request.args.get('format', fmt)
+
+    try:
+        people = parse_people(text, fmt)
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    if not people:
+        return jsonify({'success': False, 'error': 'No people to create'}), 400
+
+    filename = f"{role}-credentials-{time.strftime('%Y%m%d-%H%M%S')}.csv"
+    return Response(credentials_csv(provision_accounts(role, people)), mimetype='text/csv',
+                    headers={'Content-Disposition': f'attachment; filename="{filename}"',
+                             'X-Accel-Buffering': 'no'})
+
 # -----------------------------
 # API: Delete a message (admin)
 # -----------------------------
@@ -281,9 +439,15 @@ def delete_message(msg_id):
     try:
         conn = get_db()
         c = conn.cursor()
-        c.execute("DELETE FROM messages WHERE id = ?", (msg_id,))
-        conn.commit()
-        conn.close()
+        c.execute('BEGIN IMMEDIATE')
+        try:
+            delete_chat_message(c, msg_id)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
         return jsonify({'success': True})
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
@@ -331,116 +495,521 @@ def send_message():
         if not session_id or not user_message:
             return jsonify({'success': False, 'error': 'Missing session_id or message'}), 400
 
-        user_sent = count_session_messages(session_id, 'user')
-        if user_sent >= 10:
-            return jsonify({
-                'success': False,
-                'error': 'limit_reached',
-                'message': 'You have reached the maximum of 10 messages for this session.'
-            })
-
-        insert_message(session_id, 'user', user_message)
-        bot_response = bot_reply(user_message)
+        user_sent = session_message_count(session_id)
+        if user_sent is None:
+            return jsonify({'success': False, 'error': 'Unknown session_id'}), 400
+        if user_sent >= MESSAGE_LIMIT:
+            return jsonify({'success': False, 'error': 'limit_reached', 'message': LIMIT_REACHED_MESSAGE})
 
-        user_sent_after = count_session_messages(session_id, 'user')
-        if user_sent_after >= 10:
-            bot_response += "\n\nThis was your 10th message. This session has now ended. Thank you for using ChatPy!"
+        reply = chat_pipeline.route(user_message)
 
-        insert_message(session_id, 'bot', bot_response)
+        turn = record_chat_turn(session_id, user_message, reply['response'], reply['intent'])
+        if turn is None:
+            return jsonify({'success': False, 'error': 'limit_reached', 'message': LIMIT_REACHED_MESSAGE})
+        user_sent_after, bot_response = turn
 
         return jsonify({
             'success': True,
             'response': bot_response,
-            'messages_left': max(0, 10 - user_sent_after),
-            'session_ended': user_sent_after >= 10
+            'messages_left': max(0, MESSAGE_LIMIT - user_sent_after),
+            'session_ended': user_sent_after >= MESSAGE_LIMIT
         })
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
 # -----------------------------
-# Notices (view only)
+# Streaming (SSE) send message endpoint
+# -----------------------------
+def sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+@app.route('/api/send_message/stream', methods=['POST'])
+def send_message_stream():
+    data = request.get_json() or {}
+    session_id = data.get('session_id') or request.cookies.get('chatpy_session')
+    user_message = (data.get('message') or '').strip()
+
+    if not session_id or not user_message:
+        return jsonify({'success': False, 'error': 'Missing session_id or message'}), 400
+
+    def generate():
+        # Flush the headers straight away. The reply is computed in full on this
+        # request thread and sent as one 'done' event; only the transport is SSE
+        yield ": connected\n\n"
+        try:
+            user_sent = session_message_count(session_id)
+            if user_sent is None:
+                yield sse_event('error', {'error': 'Unknown session_id'})
+                return
+            if user_sent >= MESSAGE_LIMIT:
+                yield sse_event('error', {'error': 'limit_reached', 'message': LIMIT_REACHED_MESSAGE})
+                return
+
+            reply = chat_pipeline.route(user_message)
+
+            turn = record_chat_turn(session_id, user_message, reply['response'], reply['intent'])
+            if turn is None:
+                yield sse_event('error', {'error': 'limit_reached', 'message': LIMIT_REACHED_MESSAGE})
+                return
+            user_sent_after, bot_response = turn
+
+            yield sse_event('done', {
+                'response': bot_response,
+                'messages_left': max(0, MESSAGE_LIMIT - user_sent_after),
+                'session_ended': user_sent_after >= MESSAGE_LIMIT
+            })
+        except Exception as e:
+            yield sse_event('error', {'error': str(e)})
+
+    return Response(generate(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+# -----------------------------
+# API: Runtime metrics (admin)
+# -----------------------------
+@app.route('/api/admin/metrics', methods=['GET'])
+@admin_required
+def api_metrics():
+    return jsonify({
+        'classifier_batcher': classify_batcher.stats(),
+        'classification_cache': classification_cache.stats(),
+        'intent_tiers': chat_pipeline.stats(),
+        'message_writer': message_writer.stats(),
+        'password_verifier': password_verifier.stats(),
+        'notices_cache': notices_cache.stats(),
+    })
+
+# -----------------------------
+# Notices
 # -----------------------------
 @app.route('/notices')
 @login_required
 def view_notices():
+    snapshot = notices_cache.get()
+    # Besides the notices, the page depends on the viewer's role (admins get delete
+    # buttons) and on the asset build its CSS/JS URLs point at
+    build_id, built_at = asset_build()
+    etag = f"{snapshot.etag}-{session.get('user_role')}-{build_id}"
+    last_modified = max(snapshot.last_modified, built_at) if built_at else snapshot.last_modified
+    response = not_modified(etag, last_modified)
+    if response is None:
+        response = make_response(render_template("Notices.html", notices=snapshot.notices))
+    return with_validators(response, etag, last_modified)
+
+def not_modified(etag, last_modified):
+    """An empty 304 if the client's If-None-Match / If-Modified-Since still hold, else None."""
+    if request.if_none_match:
+        fresh = request.if_none_match.contains(etag)
+    elif request.if_modified_since:
+        fresh = last_modified <= request.if_modified_since
+    else:
+        fresh = False
+    return Response(status=304) if fresh else None
+
+def with_validators(response, etag, last_modified):
+    response.set_etag(etag)
+    response.last_modified = last_modified
+    # Logged-in content: browsers may keep it but must revalidate every time
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+@app.route('/api/notices', methods=['GET'])
+@login_required
+def api_notices():
+    snapshot = notices_cache.get()
+    response = not_modified(snapshot.etag, snapshot.last_modified)
+    if response is None:
+        response = jsonify({'success': True, 'version': snapshot.version, 'notices': snapshot.notices})
+    return with_validators(response, snapshot.etag, snapshot.last_modified)
+
+@app.route('/api/notices', methods=['POST'])
+@admin_required
+def api_create_notice():
+    data = request.get_json() or {}
+    title = (data.get('title') or '').strip()
+    content = (data.get('content') or '').strip()
+    if not title or not content:
+        return jsonify({'success': False, 'error': 'Title and content required'}), 400
+    conn = get_db()
+    c = conn.cursor()
+    c.execute("INSERT INTO notices (title, content) VALUES (?, ?)", (title, content))
+    notice_id = c.lastrowid
+    conn.commit()
+    conn.close()
+    notices_cache.invalidate()
+    return jsonify({'success': True, 'id': notice_id})
+
+@app.route('/api/notices/<int:notice_id>', methods=['DELETE'])
+@admin_required
+def api_delete_notice(notice_id):
     conn = get_db()
     c = conn.cursor()
-    c.execute("SELECT title, content, created_at FROM notices ORDER BY created_at DESC")
-    notices = c.fetchall()
+    c.execute("DELETE FROM notices WHERE id = ?", (notice_id,))
+    deleted = c.rowcount
+    conn.commit()
     conn.close()
-    return render_template("Notices.html", notices=notices)
+    notices_cache.invalidate()
+    if not deleted:
+        return jsonify({'success': False, 'error': 'Notice not found'}), 404
+    return jsonify({'success': True})
 
 # -----------------------------
 # Records page (Admin)
 # -----------------------------
-# Replace your current /records route with this fixed version:
-
 @app.route('/records', methods=['GET', 'POST'])
 @admin_required
 def records():
-    conn = get_db()
-    c = conn.cursor()
-
-    # Always fetch chatbot messages (no filters applied to messages currently)
-    c.execute('''
-              SELECT m.id, m.session_id, m.sender, m.content, m.timestamp, u.full_name
-              FROM messages m
-                       LEFT JOIN sessions s ON m.session_id = s.session_id
-                       LEFT JOIN users u ON s.user_id = u.id
-              ORDER BY m.timestamp DESC
-              ''')
-    messages = [dict(row) for row in c.fetchall()]
-
     # Initialize variables for form data
     report_type = 'booking'  # default
     service_categories = []
     sort_options = []
+    date_from = ''
+    date_to = ''
 
     # Get form data if POST request
     if request.method == 'POST':
         report_type = request.form.get('report_type', 'booking')
         service_categories = request.form.getlist('service_category')
         sort_options = request.form.getlist('sort')
+        date_from = request.form.get('date_from', '')
+        date_to = request.form.get('date_to', '')
 
-    # Build bookings query with filters
-    query = "SELECT id, fname, lname, classification, service, slot, created_at FROM bookings"
-    filters = []
-    params = []
+    # The messages and bookings tables are filled page by page from
+    # /api/admin/messages and /api/admin/bookings using these filters
+    return render_template("Admin.html",
+                           report_type=report_type,
+                           selected_services=service_categories,
+                           selected_sorts=sort_options,
+                           date_from=date_from,
+                           date_to=date_to)
 
-    # Apply service category filter if provided
-    if service_categories:
-        placeholders = ",".join("?" for _ in service_categories)
-        filters.append(f"service IN ({placeholders})")
-        params.extend(service_categories)
+# -----------------------------
+# Admin API: reporting stats
+# -----------------------------
+@app.route('/api/admin/stats', methods=['GET'])
+@admin_required
+def api_admin_stats():
+    """Dashboard and report stats, read from the summary tables (?days= for the daily series)."""
+    try:
+        days = max(1, min(int(request.args.get('days', 30)), 366))
+    except ValueError:
+        return jsonify({'success': False, 'error': 'Invalid days'}), 400
+    conn = get_db()
+    stats = read_stats(conn, days)
+    conn.close()
+    return jsonify({'success': True, **stats})
 
-    # Add WHERE clause if filters exist
-    if filters:
-        query += " WHERE " + " AND ".join(filters)
+# -----------------------------
+# Admin API: paginated messages & bookings
+# -----------------------------
+ADMIN_PAGE_SIZE = 50
+ADMIN_MAX_PAGE_SIZE = 200
 
-    # Apply sorting
-    if 'alphabetical' in sort_options:
-        query += " ORDER BY fname ASC, lname ASC"
-    elif 'date' in sort_options:
-        query += " ORDER BY created_at DESC"
-    else:
-        query += " ORDER BY created_at DESC"  # default sort
+def page_size_arg():
+    try:
+        size = int(request.args.get('limit', ADMIN_PAGE_SIZE))
+    except ValueError:
+        size = ADMIN_PAGE_SIZE
+    return max(1, min(size, ADMIN_MAX_PAGE_SIZE))
+
+def date_range_filters(column, args):
+    """WHERE clauses for ?from=YYYY-MM-DD&to=YYYY-MM-DD (both inclusive) on a timestamp column."""
+    filters, params = [], []
+    if args.get('from'):
+        filters.append(f"{column} >= date(?)")
+        params.append(args['from'])
+    if args.get('to'):
+        filters.append(f"{column} < date(?, '+1 day')")
+        params.append(args['to'])
+    return filters, params
+
+def message_filters(args):
+    """WHERE clauses for the session, sender and date range filters on messages m."""
+    filters, params = date_range_filters('m.timestamp', args)
+    if args.get('session_id'):
+        filters.append("m.session_id = ?")
+        params.append(args['session_id'])
+    if args.get('sender'):
+        filters.append("m.sender = ?")
+        params.append(args['sender'])
+    return filters, params
+
+def message_text_filter(conn, text):
+    """WHERE clause for ?q= on messages m: an FTS5 lookup, or LIKE when FTS5 is unavailable."""
+    match = fts_query(text)
+    if match is not None and has_message_fts(conn):
+        return MESSAGE_FTS_FILTER, match
+    return "m.content LIKE ? ESCAPE '\\'", '%' + re.sub(r'([%_\\])', r'\\\1', text) + '%'
+
+def booking_filters(args):
+    """WHERE clauses for the service (repeatable) and date range filters on bookings."""
+    filters, params = date_range_filters('created_at', args)
+    services = args.getlist('service')
+    if services:
+        filters.append(f"service IN ({','.join('?' for _ in services)})")
+        params.extend(services)
+    return filters, params
+
+@app.route('/api/admin/messages', methods=['GET'])
+@admin_required
+def api_admin_messages():
+    """
+    Messages newest first, keyset-paginated on (timestamp, id). With ?archive=1
+    the pages carry on into the monthly archives once the hot table runs out.
+    """
+    conn = get_db()
+    filters, params = message_filters(request.args)
+    if request.args.get('q'):
+        text_filter, text_param = message_text_filter(conn, request.args['q'])
+        filters.append(text_filter)
+        params.append(text_param)
+    limit = page_size_arg()
+    before = None
+    try:
+        if request.args.get('cursor'):
+            before = decode_cursor(request.args['cursor'])
+            filters.append(ADMIN_MESSAGES_AFTER)
+            params.extend(before)
+    except ValueError:
+        return jsonify({'success': False, 'error': 'Invalid cursor'}), 400
+
+    query = ADMIN_MESSAGES_QUERY.format(where=where_clause(filters))
+    rows = [dict(row) for row in conn.execute(query, params + [limit + 1])]
+    if request.args.get('archive') == '1' and len(rows) <= limit:
+        # Archived messages are all older than the hot ones, so the same key continues
+        if rows:
+            before = [rows[-1]['timestamp'], rows[-1]['id']]
+        try:
+            rows += search_archive(conn, session_id=request.args.get('session_id'),
+                                   sender=request.args.get('sender'),
+                                   date_from=request.args.get('from'), date_to=request.args.get('to'),
+                                   q=request.args.get('q'), before=before, limit=limit + 1 - len(rows))
+        except ValueError:
+            conn.close()
+            return jsonify({'success': False, 'error': 'Invalid date'}), 400
+    conn.close()
 
-    c.execute(query, params)
-    bookings = [dict(row) for row in c.fetchall()]
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor([rows[-1]['timestamp'], rows[-1]['id']])
+    return jsonify({'success': True, 'items': rows, 'next_cursor': next_cursor})
+
+@app.route('/api/admin/messages/search', methods=['GET'])
+@admin_required
+def api_admin_message_search():
+    """
+    Messages matching ?q= (FTS5), newest first, with the same filters as
+    /api/admin/messages and keyset-paginated on id. Each row carries its bm25
+    score (lower is more relevant); pages are not ordered by it because scores
+    shift whenever the index changes.
+    """
+    match = fts_query(request.args.get('q', ''))
+    if match is None:
+        return jsonify({'success': False, 'error': 'Search text required'}), 400
 
+    conn = get_db()
+    if not has_message_fts(conn):
+        return jsonify({'success': False, 'error': 'Full-text search is not available'}), 503
+
+    filters, params = message_filters(request.args)
+    filters.insert(0, MESSAGE_SEARCH_MATCH)
+    params.insert(0, match)
+    limit = page_size_arg()
+    try:
+        if request.args.get('cursor'):
+            key = decode_cursor(request.args['cursor'])
+            if len(key) != 1:
+                raise ValueError("cursor is not a search cursor")
+            filters.append(MESSAGE_SEARCH_AFTER)
+            params.extend(key)
+    except ValueError:
+        return jsonify({'success': False, 'error': 'Invalid cursor'}), 400
+
+    query = MESSAGE_SEARCH_QUERY.format(where=where_clause(filters))
+    rows = [dict(row) for row in conn.execute(query, params + [limit + 1])]
     conn.close()
 
-    # Pass data to template
-    return render_template("Admin.html",
-                           messages=messages,
-                           bookings=bookings,
-                           report_type=report_type,
-                           selected_services=service_categories,
-                           selected_sorts=sort_options)
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor([rows[-1]['id']])
+    return jsonify({'success': True, 'items': rows, 'next_cursor': next_cursor})
+
+@app.route('/api/admin/bookings', methods=['GET'])
+@admin_required
+def api_admin_bookings():
+    """
+    Bookings keyset-paginated: newest first on (created_at, id) by default,
+    or on (fname, lname, id) with ?sort=alphabetical.
+    """
+    filters, params = booking_filters(request.args)
+    limit = page_size_arg()
+    sort = 'alphabetical' if request.args.get('sort') == 'alphabetical' else 'recent'
+    key_columns, after, order = BOOKING_SORTS[sort]
+    try:
+        if request.args.get('cursor'):
+            key = decode_cursor(request.args['cursor'])
+            if len(key) != len(key_columns):
+                raise ValueError("cursor does not match sort")
+            filters.append(after)
+            params.extend(key)
+    except ValueError:
+        return jsonify({'success': False, 'error': 'Invalid cursor'}), 400
+
+    query = ADMIN_BOOKINGS_QUERY.format(where=where_clause(filters), order=order)
+    conn = get_db()
+    rows = [dict(row) for row in conn.execute(query, params + [limit + 1])]
+    conn.close()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor([rows[-1][column] for column in key_columns])
+    return jsonify({'success': True, 'items': rows, 'next_cursor': next_cursor})
+
+# -----------------------------
+# Admin API: streaming exports
+# -----------------------------
+EXPORT_CHUNK_ROWS = int(os.environ.get('UOK_EXPORT_CHUNK_ROWS', 1000))
+
+BOOKING_EXPORT_COLUMNS = ('id', 'fname', 'lname', 'classification', 'service', 'slot', 'created_at')
+MESSAGE_EXPORT_COLUMNS = ('id', 'session_id', 'full_name', 'sender', 'content', 'intent', 'timestamp')
+
+def export_chunks(query, params, columns, fmt):
+    """
+    Yield the rows of query encoded as CSV or a JSON array, EXPORT_CHUNK_ROWS at a
+    time. The rows are read with fetchmany from a connection of its own, so memory
+    stays flat however large the export is (WAL readers do not block writers).
+    """
+    # Runs after the view has returned and the request's connection is released
+    conn = get_db()
+    try:
+        cursor = conn.execute(query, params)
+        first = True
+        if fmt == 'csv':
+            buffer = io.StringIO()
+            writer = csv.writer(buffer)
+            writer.writerow(columns)
+        else:
+            yield '['
+        while True:
+            rows = cursor.fetchmany(EXPORT_CHUNK_ROWS)
+            if not rows:
+                break
+            if fmt == 'csv':
+                writer.writerows(rows)
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+            else:
+                chunk = ','.join(json.dumps(dict(zip(columns, row))) for row in rows)
+                yield chunk if first else ',' + chunk
+                first = False
+        if fmt != 'csv':
+            yield ']'
+        elif buffer.tell():
+            yield buffer.getvalue()
+    finally:
+        conn.close()
+
+def gzip_chunks(chunks):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits 31: gzip container
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode('utf-8'))
+        if data:
+            yield data
+    yield compressor.flush()
+
+def export_response(name, query, params, columns):
+    """Streaming download of query in ?format=csv (default) or json, gzipped with ?gzip=1."""
+    fmt = request.args.get('format', 'csv')
+    if fmt not in ('csv', 'json'):
+        return jsonify({'success': False, 'error': 'format must be csv or json'}), 400
+
+    chunks = export_chunks(query, params, columns, fmt)
+    filename = f"{name}-{time.strftime('%Y%m%d')}.{fmt}"
+    mimetype = 'text/csv' if fmt == 'csv' else 'application/json'
+    if request.args.get('gzip') == '1':
+        chunks = gzip_chunks(chunks)
+        filename += '.gz'
+        mimetype = 'application/gzip'
+    return Response(chunks, mimetype=mimetype,
+                    headers={'Content-Disposition': f'attachment; filename="{filename}"',
+                             'X-Accel-Buffering': 'no'})
+
+@app.route('/api/admin/export/bookings', methods=['GET'])
+@admin_required
+def export_bookings():
+    """All bookings matching the records filters (service, sort, from/to)."""
+    filters, params = booking_filters(request.args)
+    query = f"SELECT {', '.join(BOOKING_EXPORT_COLUMNS)} FROM bookings"
+    if filters:
+        query += " WHERE " + " AND ".join(filters)
+    sort = 'alphabetical' if request.args.get('sort') == 'alphabetical' else 'recent'
+    query += " ORDER BY " + BOOKING_SORTS[sort][2]
+    return export_response('bookings', query, params, BOOKING_EXPORT_COLUMNS)
+
+@app.route('/api/admin/export/messages', methods=['GET'])
+@admin_required
+def export_messages():
+    """All hot-table messages matching the records filters (session_id, sender, from/to, q)."""
+    filters, params = message_filters(request.args)
+    if request.args.get('q'):
+        text_filter, text_param = message_text_filter(get_db(), request.args['q'])
+        filters.append(text_filter)
+        params.append(text_param)
+    query = """
+        SELECT m.id, m.session_id, u.full_name, m.sender, m.content, m.intent, m.timestamp
+        FROM messages m
+        LEFT JOIN sessions s ON m.session_id = s.session_id
+        LEFT JOIN users u ON s.user_id = u.id
+    """
+    if filters:
+        query += " WHERE " + " AND ".join(filters)
+    query += " ORDER BY m.timestamp DESC, m.id DESC"
+    return export_response('messages', query, params, MESSAGE_EXPORT_COLUMNS)
 
 # -----------------------------
 # Booking route (all roles)
 # -----------------------------
+def reserve_slot(slot_id, fname, lname, classification, account=(None, None)):
+    """
+    Book one seat in a slot: a conditional UPDATE takes a seat only while one is
+    left (and the slot has not started), and the booking is inserted in the same
+    transaction, so concurrent bookings can never overfill a slot.
+    account is the (role, id) the booking belongs to, see booking_account().
+    Returns the new booking id, or None if the slot is full, past or unknown.
+    """
+    conn = get_db()
+    c = conn.cursor()
+    try:
+        c.execute('BEGIN IMMEDIATE')
+        c.execute('''UPDATE slots SET remaining = remaining - 1
+                     WHERE id = ? AND remaining > 0 AND starts_at >= datetime('now')''', (slot_id,))
+        if c.rowcount == 0:
+            conn.rollback()
+            return None
+        slot = c.execute('SELECT service, starts_at FROM slots WHERE id = ?', (slot_id,)).fetchone()
+        c.execute('''INSERT INTO bookings (fname, lname, classification, service, slot, slot_id,
+                                           account_role, account_id)
+                     VALUES (?, ?, ?, ?, ?, ?, ?, ?)''',
+                  (fname, lname, classification, slot['service'], slot['starts_at'], slot_id, *account))
+        booking_id = c.lastrowid
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+    return booking_id
+
+def booking_account():
+    """(role, id) of the logged-in student or employee a new booking belongs to; (None, None) for admins."""
+    if session.get('user_role') in ('student', 'employee'):
+        return session['user_role'], session['user_id']
+    return None, None
+
 @app.route('/booking', methods=['GET', 'POST'])
 @role_required('admin', 'employee', 'student')
 def booking():
@@ -451,10 +1020,23 @@ def booking():
             classification = request.form.get('classification')
             service = request.form.get('service')
             slot = request.form.get('slot')
+            slot_id = request.form.get('slot_id', type=int)
+            account = booking_account()
+            if slot_id is not None:
+                if reserve_slot(slot_id, fname, lname, classification, account) is None:
+                    return render_template("Booking.html", error="That slot is no longer available")
+                return render_template("Booking.html", success=True)
+
+            # Services without a slot inventory still take the free-form slot; the
+            # others must go through reserve_slot so their capacity is enforced
             conn = get_db()
             c = conn.cursor()
-            c.execute('INSERT INTO bookings (fname, lname, classification, service, slot) VALUES (?, ?, ?, ?, ?)',
-                      (fname, lname, classification, service, slot))
+            if c.execute('SELECT 1 FROM slots WHERE service = ? LIMIT 1', (service,)).fetchone():
+                conn.close()
+                return render_template("Booking.html", error="Please choose one of the available time slots")
+            c.execute('''INSERT INTO bookings (fname, lname, classification, service, slot, account_role, account_id)
+                         VALUES (?, ?, ?, ?, ?, ?, ?)''',
+                      (fname, lname, classification, service, slot, *account))
             conn.commit()
             conn.close()
             return render_template("Booking.html", success=True)
@@ -462,6 +1044,195 @@ def booking():
             return render_template("Booking.html", error=str(e))
     return render_template("Booking.html")
 
+@app.route('/api/slots', methods=['GET'])
+@role_required('admin', 'employee', 'student')
+def api_slots():
+    """Upcoming slots of ?service= that still have seats, soonest first (read from slots only)."""
+    service = request.args.get('service', '').strip()
+    if not service:
+        return jsonify({'success': False, 'error': 'service required'}), 400
+    limit = page_size_arg()
+    since = request.args.get('from') or time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime())
+    conn = get_db()
+    slots = [dict(row) for row in conn.execute('''
+        SELECT id, service, starts_at, capacity, remaining FROM slots
+        WHERE service = ? AND starts_at >= ? AND remaining > 0
+        ORDER BY starts_at LIMIT ?''', (service, since, limit))]
+    conn.close()
+    return jsonify({'success': True, 'slots': slots})
+
+@app.route('/api/admin/slots', methods=['POST'])
+@admin_required
+def api_admin_slots():
+    """
+    Create slots, or change the capacity of existing ones, from one
+    {"service", "starts_at", "capacity"} object or a list of them. Seats already
+    booked stay booked, so capacity cannot drop below them.
+    """
+    data = request.get_json() or []
+    items = data if isinstance(data, list) else [data]
+    rows = []
+    for item in items:
+        service = str(item.get('service') or '').strip() if isinstance(item, dict) else ''
+        starts_at = str(item.get('starts_at') or '').strip() if isinstance(item, dict) else ''
+        try:
+            capacity = int(item.get('capacity'))
+        except (AttributeError, TypeError, ValueError):
+            capacity = -1
+        if not service or not starts_at or capacity < 0:
+            return jsonify({'success': False, 'error': 'service, starts_at and a capacity >= 0 required'}), 400
+        try:
+            # Stored in SQLite's own format so it compares correctly against datetime('now')
+            parsed = datetime.fromisoformat(starts_at)
+            if parsed.tzinfo is not None:
+                parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+            starts_at = parsed.strftime('%Y-%m-%d %H:%M:%S')
+        except ValueError:
+            return jsonify({'success': False, 'error': f'Invalid starts_at {starts_at!r}: use YYYY-MM-DD HH:MM'}), 400
+        rows.append((service, starts_at, capacity, capacity))
+
+    conn = get_db()
+    try:
+        conn.execute('BEGIN IMMEDIATE')
+        conn.executemany('''INSERT INTO slots (service, starts_at, capacity, remaining) VALUES (?, ?, ?, ?)
+                            ON CONFLICT (service, starts_at) DO UPDATE
+                            SET remaining = remaining + excluded.capacity - capacity,
+                                capacity = excluded.capacity''', rows)
+        conn.commit()
+    except sqlite3.IntegrityError:
+        conn.rollback()
+        return jsonify({'success': False, 'error': 'Capacity is below the seats already booked'}), 409
+    finally:
+        conn.close()
+    return jsonify({'success': True, 'count': len(rows)})
+
+# -----------------------------
+# CLI commands
+# -----------------------------
+@app.cli.command('check-parity')
+def check_parity_command():
+    """Check the NumPy inference backend against Keras on the intent patterns."""
+    sentences = [p for intent in load_intents()['intents'] for p in intent.get('patterns', [])]
+    diff = check_backend_parity(sentences)
+    print(f"NumPy and Keras backends agree on {len(sentences)} sentences (max abs diff {diff:.2e})")
+
+@app.cli.command('check-query-plans')
+def check_query_plans_command():
+    """EXPLAIN QUERY PLAN the hot queries and fail if any of them scans a table without an index."""
+    conn = get_db()
+    report = explain_hot_queries(conn)
+    conn.close()
+
+    failures = []
+    for name, (plan, full_scans) in report.items():
+        print(f"{'FAIL' if full_scans else 'ok  '} {name}")
+        for step in plan:
+            print(f"       {step}")
+        if full_scans:
+            failures.append(name)
+    if failures:
+        raise click.ClickException(f"full table scans in: {', '.join(failures)}")
+
+@app.cli.command('export-bundle')
+def export_bundle_command():
+    """Convert words.pkl, classes.pkl and the .keras model into the serving bundle."""
+    import pickle
+    # One writer for the format, shared with model_training.py
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'Model_Prep'))
+    from model_bundle import write_bundle
+    with open(WORDS_PATH, 'rb') as f:
+        words = pickle.load(f)
+    with open(CLASSES_PATH, 'rb') as f:
+        classes = pickle.load(f)
+    write_bundle(BUNDLE_PATH, words, classes, load_dense_layers(MODEL_PATH))
+    header, _ = load_model_bundle(BUNDLE_PATH, verify=True)
+    print(f"Wrote {BUNDLE_PATH} ({len(header['words'])} words, {len(header['classes'])} classes, "
+          f"version {header['payload_sha256'][:12]})")
+
+@app.cli.command('bench-startup')
+@click.option('--runs', default=5, show_default=True, help='Number of cold starts to time.')
+@click.option('--max-seconds', type=float, default=None,
+              help='Exit with an error if the median cold start is slower than this.')
+def bench_startup_command(runs, max_seconds):
+    """Time cold imports of the app in fresh interpreters."""
+    app_dir = os.path.dirname(os.path.abspath(__file__))
+    timings = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        subprocess.run([sys.executable, '-c', 'import app'], cwd=app_dir, check=True)
+        timings.append(time.perf_counter() - started)
+
+    timings.sort()
+    median = timings[len(timings) // 2]
+    print(f"cold start over {runs} runs: min {timings[0]:.3f}s, "
+          f"median {median:.3f}s, max {timings[-1]:.3f}s")
+    if max_seconds is not None and median > max_seconds:
+        raise click.ClickException(f"median cold start {median:.3f}s exceeds {max_seconds:.3f}s")
+
+@app.cli.command('archive-messages')
+@click.option('--days', type=int, default=MESSAGE_RETENTION_DAYS, show_default=True,
+              help='Archive messages older than this many days.')
+def archive_messages_command(days):
+    """Move old chat messages from the hot table into the monthly archives."""
+    conn = get_db()
+    moved = archive_messages(conn, older_than_days=days)
+    # Checkpoint now so the WAL that grew during the move is truncated
+    conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    conn.close()
+    for month, count in sorted(moved.items()):
+        print(f"{month}: archived {count} messages to {archive_path(month)}")
+    print(f"Archived {sum(moved.values())} messages older than {days} days")
+
+@app.cli.command('rebuild-stats')
+def rebuild_stats_command():
+    """Recompute the reporting stats tables from bookings, sessions and messages."""
+    conn = get_db()
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        rebuild_stats(conn)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    totals = read_stats(conn)['totals']
+    conn.close()
+    print(f"Rebuilt stats: {totals['bookings']} bookings, {totals['sessions']} sessions, "
+          f"{totals['messages']} messages")
+
+@app.cli.command('provision')
+@click.argument('role', type=click.Choice(sorted(PROVISION_TABLES)))
+@click.argument('source', type=click.File('r', encoding='utf-8-sig'))
+@click.option('--output', '-o', type=click.File('w'), default='-',
+              help='Where to write the generated credentials (CSV). Defaults to stdout.')
+@click.option('--format', 'fmt', type=click.Choice(['csv', 'json']), default=None,
+              help='Input format; guessed from the file name when omitted.')
+def provision_command(role, source, output, fmt):
+    """Create employee or student accounts in bulk from a CSV or JSON file."""
+    fmt = fmt or ('json' if source.name.lower().endswith('.json') else 'csv')
+    try:
+        people = parse_people(source.read(), fmt)
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    started = time.perf_counter()
+    try:
+        for block in credentials_csv(provision_accounts(role, people), reraise=True):
+            output.write(block)
+    except Exception as e:
+        raise click.ClickException(f"Provisioning stopped part way, see the ERROR row in the output: {e}")
+    click.echo(f"Created {len(people)} {role} accounts in {time.perf_counter() - started:.1f}s", err=True)
+
+@app.cli.command('build-assets')
+@click.option('--prune', is_flag=True, help='Delete built files that are no longer in the manifest.')
+def build_assets_command(prune):
+    """Write fingerprinted, precompressed copies of the static CSS/JS for /assets."""
+    manifest = build_assets(prune=prune)
+    for logical, hashed in sorted(manifest.items()):
+        print(f"{logical} -> {hashed}")
+    print(f"Built {len(manifest)} assets into {ASSET_DIR}")
+    import importlib.util
+    if importlib.util.find_spec('brotli') is None:
+        click.echo("brotli is not installed: wrote .gz variants only", err=True)
+
 # Run app
 if __name__ == '__main__':
     app.run(debug=True)
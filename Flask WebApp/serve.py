@@ -0,0 +1,120 @@
+"""
+Production entry point: runs the app under gunicorn.
+
+    python serve.py
+
+The intent index and the chatbot model are loaded in the master process before
+it forks, so every worker shares them copy-on-write instead of loading its own.
+While running, the master watches intents.json and the model files; when they
+change it reloads the model itself and sends itself SIGHUP, which replaces the
+workers gracefully with ones forked from the refreshed master.
+
+That applies to the default numpy backend. With UOK_INFERENCE_BACKEND=keras the
+master never imports TensorFlow, which is not fork-safe: each worker loads the
+model in the background after it is forked, and a reload is not validated in the
+master before the workers are replaced.
+
+Run `flask build-assets` before starting (and after changing static/) so pages
+link the fingerprinted, precompressed CSS/JS served from /assets/.
+
+Settings (environment variables):
+    UOK_BIND             address to listen on            (default 0.0.0.0:8000)
+    UOK_DB               SQLite database file            (default UoK.db)
+    UOK_WORKERS          worker processes                (default: number of CPUs)
+    UOK_THREADS          threads per worker              (default 4)
+    UOK_WORKER_CLASS     gunicorn worker class           (default gthread; only the threaded
+                         workers are supported: the message writer and the classify
+                         batcher run OS threads that a gevent/eventlet worker would not
+                         cooperate with. A chat reply, streamed or not, holds a
+                         thread while it is computed.)
+    UOK_TIMEOUT          worker timeout in seconds       (default 30)
+    UOK_LOGIN_MAX_PENDING  logins in progress per worker before new ones get a 503
+                         (default UOK_THREADS // 2, so chat always keeps threads)
+    UOK_RELOAD_INTERVAL  seconds between artifact checks (default 5, 0 disables)
+    UOK_MESSAGE_DURABILITY  async (default) or sync: whether chat replies wait for
+                         their messages to be committed
+    UOK_MESSAGE_RETRY_SECONDS  how long queued messages are retried while the database
+                         is locked before they are dropped and logged (default 60)
+"""
+import os
+import time
+import signal
+import threading
+import multiprocessing
+
+from gunicorn.app.base import BaseApplication
+
+import utils
+from app import app
+
+
+def watch_artifacts(server, interval):
+    """Master-side thread: reload the model and recycle workers when artifacts change."""
+    signature = utils.artifacts_signature()
+    while True:
+        time.sleep(interval)
+        current = utils.artifacts_signature()
+        if current == signature:
+            continue
+        signature = current
+        try:
+            utils.reload_chatbot()
+        except Exception as e:
+            server.log.error("Model reload failed, keeping the current workers: %s", e)
+            continue
+        server.log.info("Model artifacts changed, reloading workers")
+        os.kill(os.getpid(), signal.SIGHUP)
+
+
+def when_ready(server):
+    interval = float(os.environ.get('UOK_RELOAD_INTERVAL', 5))
+    if interval > 0:
+        threading.Thread(target=watch_artifacts, args=(server, interval),
+                         daemon=True, name='artifact-watcher').start()
+
+
+def post_fork(server, worker):
+    utils.after_fork()
+
+
+def worker_exit(server, worker):
+    # Commit chat messages still queued in the write-behind writer
+    utils.message_writer.stop()
+
+
+class UoKServer(BaseApplication):
+    def __init__(self, application, options):
+        self.application = application
+        self.options = options
+        super().__init__()
+
+    def load_config(self):
+        for key, value in self.options.items():
+            self.cfg.set(key, value)
+
+    def load(self):
+        return self.application
+
+
+def options_from_env():
+    return {
+        'bind': os.environ.get('UOK_BIND', '0.0.0.0:8000'),
+        'workers': int(os.environ.get('UOK_WORKERS', multiprocessing.cpu_count())),
+        'threads': int(os.environ.get('UOK_THREADS', 4)),
+        'worker_class': os.environ.get('UOK_WORKER_CLASS', 'gthread'),
+        'timeout': int(os.environ.get('UOK_TIMEOUT', 30)),
+        'preload_app': True,
+        'when_ready': when_ready,
+        'post_fork': post_fork,
+        'worker_exit': worker_exit,
+    }
+
+
+if __name__ == '__main__':
+    try:
+        utils.preload_chatbot()
+    except Exception as e:
+        app.logger.warning("Chatbot model not preloaded: %s", e)
+    # Workers open their own connections; none may be inherited from the master
+    utils.close_db_pool()
+    UoKServer(app, options_from_env()).run()
@@ -124,19 +124,23 @@
             document.getElementById('messageInput').placeholder = "Session ended. Refresh to start a new session.";
         }
 
-        function addMessage(sender, content) {
-            const messagesContainer = document.getElementById('messages');
-            const messageDiv = document.createElement('div');
-            messageDiv.classList.add('message', sender);
-
+        function setMessageContent(messageDiv, sender, content) {
             if (sender === 'bot') {
                 messageDiv.innerHTML = '<span class="bot-icon">🤖</span>' + content.replace(/\n/g, '<br>');
             } else {
                 messageDiv.innerHTML = content.replace(/\n/g, '<br>');
             }
+        }
+
+        function addMessage(sender, content) {
+            const messagesContainer = document.getElementById('messages');
+            const messageDiv = document.createElement('div');
+            messageDiv.classList.add('message', sender);
+            setMessageContent(messageDiv, sender, content);
 
             messagesContainer.appendChild(messageDiv);
             messagesContainer.scrollTop = messagesContainer.scrollHeight;
+            return messageDiv;
         }
 
         function showTypingIndicator() {
@@ -148,6 +152,60 @@
             document.getElementById('typingIndicator').style.display = 'none';
         }
 
+        function handleChatResult(data) {
+            if (data.success) {
+                messagesLeft = data.messages_left;
+
+                if (data.session_ended) {
+                    sessionEnded = true;
+                    disableChat();
+                }
+            } else if (data.error === 'limit_reached') {
+                addMessage('bot', data.message);
+                sessionEnded = true;
+                disableChat();
+            } else {
+                addMessage('bot', 'Sorry, there was an error processing your message. Please try again.');
+            }
+        }
+
+        // Reads the Server-Sent Events reply of /api/send_message/stream
+        // (the whole answer arrives in its 'done' event). Resolves with the final result.
+        async function streamReply(response) {
+            const reader = response.body.getReader();
+            const decoder = new TextDecoder();
+            let buffer = '';
+
+            while (true) {
+                const { done, value } = await reader.read();
+                if (done) break;
+                buffer += decoder.decode(value, { stream: true });
+
+                let boundary;
+                while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+                    const rawEvent = buffer.slice(0, boundary);
+                    buffer = buffer.slice(boundary + 2);
+
+                    let event = 'message';
+                    let payload = '';
+                    rawEvent.split('\n').forEach(line => {
+                        if (line.startsWith('event:')) event = line.slice(6).trim();
+                        else if (line.startsWith('data:')) payload += line.slice(5).trim();
+                    });
+                    if (!payload) continue;
+                    const data = JSON.parse(payload);
+
+                    if (event === 'done') {
+                        addMessage('bot', data.response);
+                        return { success: true, ...data };
+                    } else if (event === 'error') {
+                        return { success: false, ...data };
+                    }
+                }
+            }
+            return { success: false, error: 'stream_closed' };
+        }
+
         async function sendMessage() {
             const messageInput = document.getElementById('messageInput');
             const message = messageInput.value.trim();
@@ -162,38 +220,37 @@
             // Show typing indicator
             showTypingIndicator();
 
+            const request = {
+                method: 'POST',
+                headers: {
+                    'Content-Type': 'application/json'
+                },
+                body: JSON.stringify({
+                    session_id: sessionId,
+                    message: message
+                })
+            };
+
             try {
-                const response = await fetch('/api/send_message', {
-                    method: 'POST',
-                    headers: {
-                        'Content-Type': 'application/json'
-                    },
-                    body: JSON.stringify({
-                        session_id: sessionId,
-                        message: message
-                    })
-                });
+                let response = await fetch('/api/send_message/stream', request);
+                const contentType = response.headers.get('Content-Type') || '';
+
+                if (response.ok && response.body && contentType.startsWith('text/event-stream')) {
+                    const result = await streamReply(response);
+                    hideTypingIndicator();
+                    handleChatResult(result);
+                    return;
+                }
 
+                // Streaming not available: fall back to the plain JSON endpoint
+                response = await fetch('/api/send_message', request);
                 const data = await response.json();
                 hideTypingIndicator();
 
                 if (data.success) {
                     addMessage('bot', data.response);
-                    messagesLeft = data.messages_left;
-
-                    if (data.session_ended) {
-                        sessionEnded = true;
-                        disableChat();
-                    }
-                } else {
-                    if (data.error === 'limit_reached') {
-                        addMessage('bot', data.message);
-                        sessionEnded = true;
-                        disableChat();
-                    } else {
-                        addMessage('bot', 'Sorry, there was an error processing your message. Please try again.');
-                    }
                 }
+                handleChatResult(data);
             } catch (error) {
                 hideTypingIndicator();
                 console.error('Error:', error);
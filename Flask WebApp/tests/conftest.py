@@ -0,0 +1,32 @@
+import os
+import sys
+
+import pytest
+
+# The app is not a package: make app.py / utils.py importable and run from its
+# directory, where the relative model/ and static/ paths resolve
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, APP_DIR)
+
+
+def pytest_configure(config):
+    config.addinivalue_line("markers", "slow: runs the app in subprocesses (deselect with -m 'not slow')")
+
+
+@pytest.fixture
+def app_dir(monkeypatch):
+    monkeypatch.chdir(APP_DIR)
+    return APP_DIR
+
+
+@pytest.fixture
+def temp_db(tmp_path, monkeypatch):
+    """A freshly created and fully migrated database, instead of UoK.db."""
+    import utils
+    monkeypatch.setattr(utils, 'DB_NAME', str(tmp_path / 'UoK.db'))
+    utils.close_db_pool()
+    utils.init_db()
+    conn = utils._connect()
+    yield conn
+    conn.discard()
+    utils.close_db_pool()
@@ -0,0 +1,40 @@
+import os
+import re
+
+import pytest
+
+import utils
+
+
+@pytest.fixture
+def model_files(app_dir):
+    if not os.path.exists(utils.MODEL_PATH) or not os.path.exists(utils.BUNDLE_PATH):
+        pytest.skip("model files not built")
+
+
+def parity_inputs():
+    # Token lists rather than sentences: NLTK tokenizing needs downloaded data, and the
+    # backends only ever see the resulting bags. Every pattern, plus each vocab word
+    # on its own so every input unit of the first layer is exercised.
+    header, _ = utils.load_model_bundle(utils.BUNDLE_PATH)
+    patterns = [re.findall(r'\w+', pattern)
+                for intent in utils.load_intents()['intents'] for pattern in intent.get('patterns', [])]
+    return patterns + [[word] for word in header['words']]
+
+
+def test_numpy_backend_matches_keras(model_files):
+    pytest.importorskip('tensorflow')
+    sentences = parity_inputs()
+    assert sentences
+    # check_backend_parity raises AssertionError itself when the backends disagree
+    assert utils.check_backend_parity(sentences, tokenized=True) <= 1e-5
+
+
+def test_bundle_matches_keras_weights(model_files):
+    pytest.importorskip('h5py')
+    header, bundled = utils.load_model_bundle(utils.BUNDLE_PATH, verify=True)
+    saved = utils.load_dense_layers(utils.MODEL_PATH)
+    assert len(bundled) == len(saved)
+    for (kernel, bias, activation), (saved_kernel, saved_bias, saved_activation) in zip(bundled, saved):
+        assert activation == saved_activation
+        assert (kernel == saved_kernel).all() and (bias == saved_bias).all()
@@ -0,0 +1,21 @@
+import utils
+
+
+def test_migrations_reach_latest_version(temp_db):
+    assert temp_db.execute("PRAGMA user_version").fetchone()[0] == len(utils.MIGRATIONS)
+
+
+def test_hot_queries_use_indexes(temp_db, monkeypatch):
+    if not utils.has_message_fts(temp_db):
+        # SQLite built without FTS5: the migration skipped the index, the search API is off
+        monkeypatch.setattr(utils, 'HOT_QUERIES',
+                            {name: q for name, q in utils.HOT_QUERIES.items() if name != 'message_search'})
+    report = utils.explain_hot_queries(temp_db)
+    full_scans = {name: plan for name, (plan, scans) in report.items() if scans}
+    assert not full_scans, f"full table scans: {full_scans}"
+
+
+def test_dropped_index_is_reported(temp_db):
+    temp_db.execute("DROP INDEX idx_bookings_account")
+    report = utils.explain_hot_queries(temp_db)
+    assert report['dashboard'][1]
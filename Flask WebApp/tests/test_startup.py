@@ -0,0 +1,23 @@
+import os
+import shutil
+import subprocess
+import sys
+
+import pytest
+
+# A cold import takes well under a second; eagerly importing TensorFlow or NLTK
+# again would cost several
+MAX_STARTUP_SECONDS = float(os.environ.get('UOK_MAX_STARTUP_SECONDS', 2.0))
+
+
+@pytest.mark.slow
+def test_cold_start_within_budget(app_dir, tmp_path):
+    # Importing the app migrates its database: point it at a copy, not the tracked UoK.db
+    db = tmp_path / 'UoK.db'
+    shutil.copyfile(os.path.join(app_dir, 'UoK.db'), db)
+    result = subprocess.run(
+        [sys.executable, '-m', 'flask', '--app', 'app', 'bench-startup',
+         '--runs', '3', '--max-seconds', str(MAX_STARTUP_SECONDS)],
+        cwd=app_dir, env=dict(os.environ, UOK_DB=str(db)), capture_output=True, text=True)
+    assert result.returncode == 0, result.stdout + result.stderr
+    assert 'cold start over 3 runs' in result.stdout
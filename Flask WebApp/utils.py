@@ -1,34 +1,647 @@
 import os
 import re
+import logging
+import atexit
+import time
+import queue
+import threading
+import multiprocessing
+from collections import Counter, OrderedDict, deque, namedtuple
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import date, datetime, timedelta, timezone
 
 os.environ['TF_CPP_MIN_LOG_LEVEL'] = '3'
 
 import sqlite3
 from functools import wraps
-from flask import session, redirect, url_for, flash
+from flask import session, redirect, url_for, flash, g, has_app_context
 
 import random
+import io
+import csv
 import json
+import zlib
+import gzip
+import posixpath
+import base64
+import itertools
+import struct
 import pickle
+import hashlib
 import numpy as np
 
-import nltk
-from nltk.stem import WordNetLemmatizer
+# NLTK and TensorFlow take seconds to import and the regex path needs neither,
+# so they are imported on first use (see clean_up_sentence and InferenceEngine.load).
 
-from tensorflow.keras.models import load_model
+from werkzeug.security import generate_password_hash, check_password_hash
 
-from werkzeug.security import generate_password_hash
+DB_NAME = os.environ.get('UOK_DB', "UoK.db")
 
-DB_NAME = "UoK.db"
+DB_POOL_SIZE = int(os.environ.get('UOK_DB_POOL_SIZE', 16))
+DB_BUSY_TIMEOUT_MS = int(os.environ.get('UOK_DB_BUSY_TIMEOUT_MS', 5000))
+DB_MMAP_SIZE = int(os.environ.get('UOK_DB_MMAP_SIZE', 256 * 1024 * 1024))
 
 #---------------------------------------------
 # Database helper
 #---------------------------------------------
-def get_db():
-    conn = sqlite3.connect(DB_NAME)
+class PooledConnection(sqlite3.Connection):
+    """
+    Connection handed out by get_db(). close() gives it back to the pool (rolling
+    back anything left uncommitted) instead of closing it. A connection bound to the
+    current request ignores close() until the request's teardown releases it.
+    """
+    request_bound = False
+
+    def close(self):
+        if not self.request_bound:
+            _release_connection(self)
+
+    def discard(self):
+        sqlite3.Connection.close(self)
+
+_pool = queue.LifoQueue(maxsize=DB_POOL_SIZE)
+_pool_pid = os.getpid()
+_inherited_pools = []
+
+def _connect():
+    conn = sqlite3.connect(DB_NAME, factory=PooledConnection, check_same_thread=False,
+                           cached_statements=256)
     conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute(f"PRAGMA busy_timeout={DB_BUSY_TIMEOUT_MS}")
+    conn.execute(f"PRAGMA mmap_size={DB_MMAP_SIZE}")
     return conn
 
+def _current_pool():
+    global _pool, _pool_pid
+    if _pool_pid != os.getpid():
+        # Connections must not be used across fork; keep the parent's alive (closing
+        # them here could checkpoint its WAL) but never hand them out in this process
+        _inherited_pools.append(_pool)
+        _pool = queue.LifoQueue(maxsize=DB_POOL_SIZE)
+        _pool_pid = os.getpid()
+    return _pool
+
+def _acquire_connection():
+    try:
+        return _current_pool().get_nowait()
+    except queue.Empty:
+        return _connect()
+
+def _release_connection(conn):
+    if _pool_pid != os.getpid():
+        return
+    try:
+        if conn.in_transaction:
+            conn.rollback()
+        _current_pool().put_nowait(conn)
+    except (queue.Full, sqlite3.Error):
+        conn.discard()
+
+def get_db():
+    """
+    Pooled connection configured for WAL. Inside an app context the same connection
+    is reused for the whole request and released by release_db on teardown; anywhere
+    else the caller's close() returns it to the pool.
+    """
+    if has_app_context():
+        conn = g.get('_db')
+        if conn is None:
+            conn = _acquire_connection()
+            conn.request_bound = True
+            g._db = conn
+        return conn
+    return _acquire_connection()
+
+def release_db(exception=None):
+    """teardown_appcontext handler: give the request's connection back to the pool."""
+    conn = g.pop('_db', None)
+    if conn is not None:
+        conn.request_bound = False
+        conn.close()
+
+def close_db_pool():
+    """Close every idle pooled connection (before forking workers, or at shutdown)."""
+    pool = _current_pool()
+    while True:
+        try:
+            pool.get_nowait().discard()
+        except queue.Empty:
+            break
+
+#---------------------------------------------
+# Write-behind message log
+#---------------------------------------------
+MESSAGE_BATCH_SIZE = int(os.environ.get('UOK_MESSAGE_BATCH_SIZE', 256))
+MESSAGE_FLUSH_MS = float(os.environ.get('UOK_MESSAGE_FLUSH_MS', 50))
+MESSAGE_QUEUE_SIZE = int(os.environ.get('UOK_MESSAGE_QUEUE_SIZE', 10000))
+MESSAGE_DURABILITY = os.environ.get('UOK_MESSAGE_DURABILITY', 'async')
+MESSAGE_INSERT = ('INSERT INTO messages (session_id, sender, content, intent, timestamp) '
+                  'VALUES (?, ?, ?, ?, ?)')
+# How long a batch keeps being retried while the database is locked before it is dropped
+MESSAGE_RETRY_SECONDS = float(os.environ.get('UOK_MESSAGE_RETRY_SECONDS', 60))
+
+class MessageWriter:
+    """
+    Background writer for chat messages with group commit.
+
+    write() puts (session_id, sender, content, intent) rows on a bounded queue; a worker
+    thread inserts whatever has queued up with one executemany in one transaction,
+    as soon as batch_size rows are waiting or flush_ms after the first of them
+    arrived. With durability='async' write() returns at once; with 'sync' it
+    returns only after the rows are committed (sharing the commit with every other
+    writer in the same batch). When the queue is full the rows are written inline
+    rather than dropped. On both paths a batch that fails because the database is
+    locked or busy (a long archive, stats rebuild or bulk import holding the write
+    lock) is retried with backoff for up to retry_seconds; any other error, or a lock
+    that outlasts the retries, drops the batch and logs it to logger.
+    flush() waits for everything queued so far; stop() also ends the worker and is
+    run at interpreter exit.
+
+    In async mode the caller has already committed its own changes (e.g. the chat
+    quota) when write() returns, so a crash before the next flush, or a dropped
+    batch, loses those messages while the rest of the turn stays recorded.
+    write_in_transaction() is for callers that need the two to be atomic.
+    """
+    def __init__(self, batch_size=256, flush_ms=50.0, maxsize=10000, durability='async', recent=1024,
+                 retry_seconds=60.0):
+        if durability not in ('async', 'sync'):
+            raise ValueError(f"durability must be 'async' or 'sync', not {durability!r}")
+        self.batch_size = max(1, int(batch_size))
+        self.flush_interval = max(0.0, float(flush_ms)) / 1000
+        self.maxsize = int(maxsize)
+        self.durability = durability
+        self.retry_seconds = float(retry_seconds)
+        # app.py points this at app.logger
+        self.logger = logging.getLogger(__name__)
+        self._lock = threading.Lock()
+        self._pid = None
+        self._queue = None
+        self._thread = None
+        self._flush_times = deque(maxlen=recent)
+        self._flush_rows = Counter()
+        self._max_depth = 0
+        self.rows_written = 0
+        self.inline_writes = 0
+        self.retries = 0
+        self.errors = 0
+        self.rows_dropped = 0
+        self.last_error = None
+
+    def start(self):
+        self._ensure_worker()
+
+    def _ensure_worker(self):
+        # The worker thread does not survive a fork, so each process starts its own
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._queue = queue.Queue(maxsize=self.maxsize)
+            self._thread = threading.Thread(target=self._run, args=(self._queue,), daemon=True,
+                                            name='message-writer')
+            self._thread.start()
+            self._pid = os.getpid()
+
+    def write(self, rows, timeout=0.1):
+        """Queue message rows; blocks until they are committed when durability is 'sync'."""
+        self._ensure_worker()
+        # Stamp the rows now so a lagging queue does not shift their timestamps
+        rows = self._stamp(rows)
+        future = Future()
+        try:
+            self._queue.put((rows, future), timeout=timeout)
+        except queue.Full:
+            with self._lock:
+                self.inline_writes += 1
+            self._commit_rows(rows)
+            with self._lock:
+                self.rows_written += len(rows)
+            return
+        depth = self._queue.qsize()
+        if depth > self._max_depth:
+            self._max_depth = depth
+        if self.durability == 'sync':
+            future.result()
+
+    def write_in_transaction(self, conn, rows):
+        """Insert rows on conn inside the caller's open transaction, bypassing the queue."""
+        conn.executemany(MESSAGE_INSERT, self._stamp(rows))
+        with self._lock:
+            self.rows_written += len(rows)
+
+    @staticmethod
+    def _stamp(rows):
+        stamp = time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime())
+        return [(*row, stamp) for row in rows]
+
+    def flush(self, timeout=None):
+        """Block until every row queued before this call is committed."""
+        if self._pid != os.getpid():
+            return
+        future = Future()
+        self._queue.put(([], future))
+        future.result(timeout)
+
+    def stop(self, timeout=10):
+        """Commit what is queued and end the worker (at shutdown)."""
+        if self._pid != os.getpid() or not self._thread.is_alive():
+            return
+        self._queue.put((None, None))
+        self._thread.join(timeout)
+
+    def _insert(self, rows, conn=None):
+        owned = conn is None
+        if owned:
+            conn = _connect()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            conn.executemany(MESSAGE_INSERT, rows)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            if owned:
+                conn.discard()
+
+    @staticmethod
+    def _is_busy(error):
+        # SQLITE_BUSY / SQLITE_LOCKED (extended codes keep the primary code in the low byte)
+        code = getattr(error, 'sqlite_errorcode', None)
+        if code is not None:
+            return code & 0xff in (sqlite3.SQLITE_BUSY, sqlite3.SQLITE_LOCKED)
+        message = str(error)
+        return 'locked' in message or 'busy' in message
+
+    def _commit_rows(self, rows, conn=None):
+        """
+        _insert, retrying with backoff while the database is locked or busy. Rows that
+        cannot be written are logged and counted as dropped, then the error is raised.
+        """
+        deadline = time.monotonic() + self.retry_seconds
+        delay = 0.05
+        while True:
+            try:
+                return self._insert(rows, conn)
+            except sqlite3.OperationalError as e:
+                if self._is_busy(e) and time.monotonic() + delay <= deadline:
+                    with self._lock:
+                        self.retries += 1
+                    time.sleep(delay)
+                    delay = min(delay * 2, 2.0)
+                    continue
+                error = e
+            except Exception as e:
+                error = e
+            self.logger.error("Message writer dropped %d messages: %s", len(rows), error)
+            with self._lock:
+                self.errors += 1
+                self.rows_dropped += len(rows)
+                self.last_error = str(error)
+            raise error
+
+    def _run(self, requests):
+        conn = _connect()
+        stopping = False
+        while not stopping:
+            batch = [requests.get()]
+            deadline = time.perf_counter() + self.flush_interval
+            pending = len(batch[0][0] or ())
+            while pending < self.batch_size:
+                remaining = deadline - time.perf_counter()
+                try:
+                    item = requests.get(timeout=remaining) if remaining > 0 else requests.get_nowait()
+                except queue.Empty:
+                    break
+                batch.append(item)
+                pending += len(item[0] or ())
+
+            if any(rows is None for rows, _ in batch):
+                # Shutdown: take everything still queued along with this batch
+                stopping = True
+                while True:
+                    try:
+                        batch.append(requests.get_nowait())
+                    except queue.Empty:
+                        break
+
+            rows = [row for item_rows, _ in batch if item_rows for row in item_rows]
+            futures = [future for _, future in batch if future is not None]
+            error = None
+            if rows:
+                started = time.perf_counter()
+                try:
+                    self._commit_rows(rows, conn)
+                except Exception as e:
+                    error = e
+                if error is None:
+                    elapsed = time.perf_counter() - started
+                    with self._lock:
+                        self.rows_written += len(rows)
+                        self._flush_rows[len(rows)] += 1
+                        self._flush_times.append(elapsed)
+            for future in futures:
+                if error is None:
+                    future.set_result(None)
+                else:
+                    future.set_exception(error)
+        conn.discard()
+
+    def stats(self):
+        with self._lock:
+            times = sorted(self._flush_times)
+            flushes = sum(self._flush_rows.values())
+            rows = sum(size * count for size, count in self._flush_rows.items())
+
+            def percentile(p):
+                return round(times[min(len(times) - 1, int(p * len(times)))] * 1000, 3) if times else 0.0
+
+            return {
+                'durability': self.durability,
+                'queue_depth': self._queue.qsize() if self._queue is not None else 0,
+                'max_queue_depth': self._max_depth,
+                'flushes': flushes,
+                'rows_written': self.rows_written,
+                'avg_rows_per_flush': round(rows / flushes, 2) if flushes else 0.0,
+                'flush_latency_ms': {'p50': percentile(0.50), 'p99': percentile(0.99),
+                                     'max': percentile(1.0)},
+                'inline_writes': self.inline_writes,
+                'retries': self.retries,
+                'errors': self.errors,
+                'rows_dropped': self.rows_dropped,
+                'last_error': self.last_error,
+            }
+
+message_writer = MessageWriter(
+    batch_size=MESSAGE_BATCH_SIZE,
+    flush_ms=MESSAGE_FLUSH_MS,
+    maxsize=MESSAGE_QUEUE_SIZE,
+    durability=MESSAGE_DURABILITY,
+    retry_seconds=MESSAGE_RETRY_SECONDS,
+)
+atexit.register(message_writer.stop)
+
+#---------------------------------------------
+# Message retention (hot table / monthly archives)
+#---------------------------------------------
+ARCHIVE_DIR = os.environ.get('UOK_ARCHIVE_DIR', 'archive')
+MESSAGE_RETENTION_DAYS = int(os.environ.get('UOK_MESSAGE_RETENTION_DAYS', 90))
+
+_ARCHIVE_FILE = re.compile(r'^messages-(\d{4}-\d{2})\.db$')
+
+def archive_path(month):
+    return os.path.join(ARCHIVE_DIR, f"messages-{month}.db")
+
+def archive_months():
+    """Months (YYYY-MM) that have an archive file, newest first."""
+    try:
+        names = os.listdir(ARCHIVE_DIR)
+    except FileNotFoundError:
+        return []
+    return sorted((m.group(1) for m in map(_ARCHIVE_FILE.match, names) if m), reverse=True)
+
+def archive_messages(conn, older_than_days=MESSAGE_RETENTION_DAYS):
+    """
+    Move messages older than older_than_days out of the hot messages table into
+    one SQLite file per month (ARCHIVE_DIR/messages-YYYY-MM.db). Each session's
+    messages for the month are stored as one zlib-compressed JSON transcript.
+    Returns {month: messages moved}.
+
+    A commit spanning main and an attached database is not atomic in WAL mode, so
+    each month is moved in two transactions: first the transcripts are committed
+    to the archive, then the messages now confirmed to be there are deleted from
+    the hot table. A crash in between leaves messages in both places, never in
+    neither; the next run skips the ones already archived and finishes the delete.
+    """
+    cutoff = conn.execute("SELECT datetime('now', ?)", (f'-{int(older_than_days)} days',)).fetchone()[0]
+    months = [row[0] for row in conn.execute(
+        "SELECT DISTINCT substr(timestamp, 1, 7) FROM messages WHERE timestamp < ?", (cutoff,))]
+    os.makedirs(ARCHIVE_DIR, exist_ok=True)
+
+    moved = {}
+    for month in sorted(months):
+        month_range = '''timestamp >= ? || '-01' AND timestamp < min(?, date(? || '-01', '+1 month'))'''
+        params = (month, cutoff, month)
+        conn.execute("ATTACH DATABASE ? AS archive", (archive_path(month),))
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                conn.execute('''CREATE TABLE IF NOT EXISTS archive.transcripts (
+                    session_id TEXT NOT NULL,
+                    first_id INTEGER NOT NULL,
+                    last_id INTEGER NOT NULL,
+                    first_ts TIMESTAMP NOT NULL,
+                    last_ts TIMESTAMP NOT NULL,
+                    message_count INTEGER NOT NULL,
+                    transcript BLOB NOT NULL,
+                    PRIMARY KEY (session_id, first_id)
+                )''')
+                rows = conn.execute(f'''SELECT id, session_id, sender, content, timestamp, intent FROM messages
+                                        WHERE {month_range} ORDER BY session_id, id''', params).fetchall()
+                transcripts = []
+                archived_ids = []
+                for session_id, group in itertools.groupby(rows, key=lambda row: row['session_id']):
+                    group = [[row['id'], row['sender'], row['content'], row['timestamp'], row['intent']]
+                             for row in group]
+                    # Left behind by an interrupted run: already in a transcript, only the delete is missing
+                    done = {m[0]
+                            for (blob,) in conn.execute('''SELECT transcript FROM archive.transcripts
+                                                          WHERE session_id = ? AND first_id <= ? AND last_id >= ?''',
+                                                       (session_id, group[-1][0], group[0][0]))
+                            for m in json.loads(zlib.decompress(blob))}
+                    archived_ids.extend(m[0] for m in group)
+                    group = [m for m in group if m[0] not in done]
+                    if group:
+                        transcripts.append((session_id, group[0][0], group[-1][0],
+                                            min(m[3] for m in group), max(m[3] for m in group), len(group),
+                                            zlib.compress(json.dumps(group).encode('utf-8'), 9)))
+                conn.executemany('''INSERT INTO archive.transcripts (session_id, first_id, last_id, first_ts,
+                                    last_ts, message_count, transcript) VALUES (?, ?, ?, ?, ?, ?, ?)''',
+                                 transcripts)
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                conn.executemany("DELETE FROM messages WHERE id = ?", [(i,) for i in archived_ids])
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+        finally:
+            conn.execute("DETACH DATABASE archive")
+        moved[month] = len(archived_ids)
+    return moved
+
+def search_archive(conn, session_id=None, sender=None, date_from=None, date_to=None, q=None,
+                   before=None, limit=50):
+    """
+    Archived messages matching the same filters as the admin messages API, newest
+    first, shaped like its rows. before=(timestamp, id) continues a keyset page.
+    q is matched word by word with text_matches, approximating the FTS5 lookup
+    used on the hot table. Raises ValueError for malformed dates.
+    """
+    lower = date.fromisoformat(date_from).isoformat() if date_from else None
+    upper = (date.fromisoformat(date_to) + timedelta(days=1)).isoformat() if date_to else None
+    before = tuple(before) if before else None
+
+    results = []
+    for month in archive_months():
+        if len(results) >= limit:
+            break
+        if (lower and month < lower[:7]) or (upper and month > upper[:7]) or \
+                (before and month > before[0][:7]):
+            continue
+
+        filters, params = [], []
+        if session_id:
+            filters.append("session_id = ?")
+            params.append(session_id)
+        if lower:
+            filters.append("last_ts >= ?")
+            params.append(lower)
+        if upper:
+            filters.append("first_ts < ?")
+            params.append(upper)
+        if before:
+            filters.append("first_ts <= ?")
+            params.append(before[0])
+        query = "SELECT session_id, transcript FROM transcripts"
+        if filters:
+            query += " WHERE " + " AND ".join(filters)
+
+        matches = []
+        archive = sqlite3.connect(f"file:{archive_path(month)}?mode=ro", uri=True)
+        try:
+            for transcript_session, blob in archive.execute(query, params):
+                for entry in json.loads(zlib.decompress(blob)):
+                    message_id, message_sender, content, timestamp = entry[:4]
+                    if (sender and message_sender != sender) or \
+                            (lower and timestamp < lower) or (upper and timestamp >= upper) or \
+                            (before and (timestamp, message_id) >= before) or \
+                            (q and not text_matches(q, content)):
+                        continue
+                    matches.append({'id': message_id, 'session_id': transcript_session,
+                                    'sender': message_sender, 'content': content,
+                                    'timestamp': timestamp})
+        finally:
+            archive.close()
+        matches.sort(key=lambda m: (m['timestamp'], m['id']), reverse=True)
+        results.extend(matches[:limit - len(results)])
+
+    session_ids = sorted({m['session_id'] for m in results})
+    names = {}
+    if session_ids:
+        names = dict(conn.execute(f"""
+            SELECT s.session_id, u.full_name FROM sessions s LEFT JOIN users u ON s.user_id = u.id
+            WHERE s.session_id IN ({','.join('?' for _ in session_ids)})""", session_ids).fetchall())
+    for m in results:
+        m['full_name'] = names.get(m['session_id'])
+        m['archived'] = True
+    return results
+
+#---------------------------------------------
+# Reporting stats (summary tables)
+#---------------------------------------------
+def rebuild_stats(c):
+    """
+    Recompute every stats table from the raw rows: bookings, sessions, the hot
+    messages table and the monthly message archives. Run inside a transaction.
+    """
+    c.execute("DELETE FROM stats_bookings_daily")
+    c.execute('''INSERT INTO stats_bookings_daily (day, service, bookings)
+                 SELECT date(created_at), service, COUNT(*) FROM bookings GROUP BY 1, 2''')
+
+    c.execute("DELETE FROM stats_session_lengths")
+    c.execute('''INSERT INTO stats_session_lengths (user_messages, sessions)
+                 SELECT user_message_count, COUNT(*) FROM sessions GROUP BY 1''')
+
+    chat_daily = {}
+    intents = Counter()
+
+    def add_messages(day, messages, user_messages):
+        row = chat_daily.setdefault(day, [0, 0, 0])
+        row[1] += messages
+        row[2] += user_messages
+
+    for row in c.execute("SELECT date(created_at), COUNT(*) FROM sessions GROUP BY 1"):
+        chat_daily.setdefault(row[0], [0, 0, 0])[0] += row[1]
+    for row in c.execute('''SELECT date(timestamp), COUNT(*), SUM(sender = 'user')
+                            FROM messages GROUP BY 1'''):
+        add_messages(*row)
+    for row in c.execute("SELECT intent, COUNT(*) FROM messages WHERE intent IS NOT NULL GROUP BY 1"):
+        intents[row[0]] += row[1]
+    for month in archive_months():
+        archive = sqlite3.connect(f"file:{archive_path(month)}?mode=ro", uri=True)
+        try:
+            for (blob,) in archive.execute("SELECT transcript FROM transcripts"):
+                for entry in json.loads(zlib.decompress(blob)):
+                    add_messages(entry[3][:10], 1, entry[1] == 'user')
+                    if len(entry) > 4 and entry[4] is not None:
+                        intents[entry[4]] += 1
+        finally:
+            archive.close()
+
+    c.execute("DELETE FROM stats_chat_daily")
+    c.executemany("INSERT INTO stats_chat_daily (day, sessions, messages, user_messages) VALUES (?, ?, ?, ?)",
+                  [(day, *counts) for day, counts in chat_daily.items() if day is not None])
+    c.execute("DELETE FROM stats_intents")
+    c.executemany("INSERT INTO stats_intents (intent, hits) VALUES (?, ?)", intents.items())
+
+def delete_chat_message(c, message_id):
+    """
+    Delete a message (admin) and take it out of the chat stats, as rebuild_stats
+    would. Run inside a transaction. Returns False if there is no such message.
+    """
+    row = c.execute("SELECT sender, intent, timestamp FROM messages WHERE id = ?", (message_id,)).fetchone()
+    if row is None:
+        return False
+    c.execute("DELETE FROM messages WHERE id = ?", (message_id,))
+    c.execute('''UPDATE stats_chat_daily SET messages = messages - 1, user_messages = user_messages - ?
+                 WHERE day = date(?)''', (row['sender'] == 'user', row['timestamp']))
+    if row['intent'] is not None:
+        c.execute("UPDATE stats_intents SET hits = hits - 1 WHERE intent = ?", (row['intent'],))
+    return True
+
+def read_stats(conn, days=30):
+    """Dashboard stats from the summary tables; never touches bookings or messages."""
+    since = (f'-{int(days)} days',)
+    by_service = [dict(row) for row in conn.execute(
+        '''SELECT service, SUM(bookings) AS bookings FROM stats_bookings_daily
+           GROUP BY service HAVING SUM(bookings) > 0 ORDER BY bookings DESC''')]
+    session_lengths = [dict(row) for row in conn.execute(
+        '''SELECT user_messages, sessions FROM stats_session_lengths
+           WHERE sessions > 0 ORDER BY user_messages''')]
+    totals = conn.execute('''SELECT COALESCE(SUM(sessions), 0) AS sessions,
+                                    COALESCE(SUM(messages), 0) AS messages,
+                                    COALESCE(SUM(user_messages), 0) AS user_messages
+                             FROM stats_chat_daily''').fetchone()
+    return {
+        'totals': {
+            'bookings': sum(row['bookings'] for row in by_service),
+            'sessions': totals['sessions'],
+            'messages': totals['messages'],
+            'avg_user_messages_per_session':
+                round(totals['user_messages'] / totals['sessions'], 2) if totals['sessions'] else 0.0,
+        },
+        'bookings_by_service': by_service,
+        'bookings_daily': [dict(row) for row in conn.execute(
+            '''SELECT day, service, bookings FROM stats_bookings_daily
+               WHERE day >= date('now', ?) AND bookings > 0 ORDER BY day, service''', since)],
+        'chat_daily': [dict(row) for row in conn.execute(
+            '''SELECT day, sessions, messages, user_messages FROM stats_chat_daily
+               WHERE day >= date('now', ?) ORDER BY day''', since)],
+        'session_lengths': session_lengths,
+        'top_intents': [dict(row) for row in conn.execute(
+            "SELECT intent, hits FROM stats_intents WHERE hits > 0 ORDER BY hits DESC, intent LIMIT 10")],
+    }
+
 # --------------------------------------------
 # Role-based access control
 # ----------------------------------------------
@@ -109,7 +722,8 @@ def init_db():
         session_id TEXT NOT NULL,
         sender TEXT NOT NULL,
         content TEXT NOT NULL,
-        timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        intent TEXT
     )''')
 
     # Sessions table
@@ -117,12 +731,14 @@ def init_db():
         id INTEGER PRIMARY KEY AUTOINCREMENT,
         session_id TEXT UNIQUE NOT NULL,
         user_id INTEGER NOT NULL,
+        user_message_count INTEGER NOT NULL DEFAULT 0,
         created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
         FOREIGN KEY (user_id) REFERENCES users (id)
     )''')
 
     # Bookings table
-    # Note: no student_id column here — bookings are recorded by names
+    # account_role/account_id link a booking to the student or employee who made it;
+    # fname/lname are only what was typed on the form
     c.execute('''CREATE TABLE IF NOT EXISTS bookings (
         id INTEGER PRIMARY KEY AUTOINCREMENT,
         fname TEXT NOT NULL,
@@ -130,7 +746,10 @@ def init_db():
         classification TEXT NOT NULL,
         service TEXT NOT NULL,
         slot TEXT NOT NULL,
-        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        slot_id INTEGER REFERENCES slots (id),
+        account_role TEXT,
+        account_id INTEGER
     )''')
 
     # Notices table
@@ -177,15 +796,610 @@ def init_db():
     admin_lname = "User"
     admin_email = "admin-user@UoK.ac.za"
     admin_password = "admin@user"
-    hashed_password = generate_password_hash(admin_password)
 
-    c.execute("""INSERT OR IGNORE INTO admin (fname, lname, email, password)
-                 VALUES (?, ?, ?, ?)""",
-              (admin_fname, admin_lname, admin_email, hashed_password))
+    # Hashing is deliberately slow, so only do it when the admin has to be seeded
+    c.execute("SELECT 1 FROM admin WHERE email = ?", (admin_email,))
+    if c.fetchone() is None:
+        hashed_password = generate_password_hash(admin_password)
+        c.execute("""INSERT OR IGNORE INTO admin (fname, lname, email, password)
+                     VALUES (?, ?, ?, ?)""",
+                  (admin_fname, admin_lname, admin_email, hashed_password))
 
     conn.commit()
+
+    migrate_db(conn)
     conn.close()
 
+# -------------------------------
+# Schema migrations
+# -------------------------------
+# Each migration runs once, in order; PRAGMA user_version records the last one
+# applied. Append new ones to MIGRATIONS - never edit or reorder existing entries.
+def _migration_session_message_count(c):
+    """sessions.user_message_count, backfilled from messages (older databases)"""
+    columns = [row['name'] for row in c.execute("PRAGMA table_info(sessions)")]
+    if 'user_message_count' not in columns:
+        c.execute("ALTER TABLE sessions ADD COLUMN user_message_count INTEGER NOT NULL DEFAULT 0")
+        c.execute('''UPDATE sessions SET user_message_count = (
+                         SELECT COUNT(*) FROM messages m
+                         WHERE m.session_id = sessions.session_id AND m.sender = 'user')''')
+
+def _migration_indexes(c):
+    """Secondary indexes for the chat, admin, records and dashboard queries"""
+    # Per-session message lookups (covering for the per-sender counts)
+    c.execute("CREATE INDEX IF NOT EXISTS idx_messages_session_sender ON messages (session_id, sender)")
+    # ORDER BY timestamp on /admin and /records (rowid rides along, so (timestamp, id) is ordered too)
+    c.execute("CREATE INDEX IF NOT EXISTS idx_messages_timestamp ON messages (timestamp)")
+    # Student dashboard: bookings by name, ordered by slot
+    c.execute("CREATE INDEX IF NOT EXISTS idx_bookings_name_slot ON bookings (fname, lname, slot)")
+    # Bookings newest first, and the service IN (...) filter on /records
+    c.execute("CREATE INDEX IF NOT EXISTS idx_bookings_created ON bookings (created_at)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_bookings_service_created ON bookings (service, created_at)")
+    # Notices newest first
+    c.execute("CREATE INDEX IF NOT EXISTS idx_notices_created ON notices (created_at)")
+
+def _migration_bookings_alphabetical_index(c):
+    """Alphabetical keyset pagination of bookings on (fname, lname, id)"""
+    c.execute("CREATE INDEX IF NOT EXISTS idx_bookings_name ON bookings (fname, lname)")
+
+def _migration_messages_fts(c):
+    """Full-text index over messages.content, kept in sync by triggers and backfilled once"""
+    try:
+        c.execute('''CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(
+                         content, content='messages', content_rowid='id',
+                         tokenize='porter unicode61')''')
+    except sqlite3.OperationalError:
+        # SQLite built without FTS5: message search falls back to LIKE
+        return
+    c.execute('''CREATE TRIGGER IF NOT EXISTS messages_fts_insert AFTER INSERT ON messages BEGIN
+                     INSERT INTO messages_fts (rowid, content) VALUES (new.id, new.content);
+                 END''')
+    c.execute('''CREATE TRIGGER IF NOT EXISTS messages_fts_delete AFTER DELETE ON messages BEGIN
+                     INSERT INTO messages_fts (messages_fts, rowid, content) VALUES ('delete', old.id, old.content);
+                 END''')
+    c.execute('''CREATE TRIGGER IF NOT EXISTS messages_fts_update AFTER UPDATE OF content ON messages BEGIN
+                     INSERT INTO messages_fts (messages_fts, rowid, content) VALUES ('delete', old.id, old.content);
+                     INSERT INTO messages_fts (rowid, content) VALUES (new.id, new.content);
+                 END''')
+    c.execute("INSERT INTO messages_fts (messages_fts) VALUES ('rebuild')")
+
+def _migration_stats_tables(c):
+    """
+    Summary tables for /api/admin/stats, maintained by triggers. Bookings per
+    service per day follow the bookings table (deletes are subtracted). Chat
+    activity (sessions and messages per day, matched intents) is only added to
+    by the triggers, since archiving deletes from messages without the messages
+    leaving the history; an admin deleting a message goes through
+    delete_chat_message, which subtracts it. rebuild_stats recomputes every
+    table from bookings, sessions, messages and the archives, and agrees with both.
+    """
+    columns = [row['name'] for row in c.execute("PRAGMA table_info(messages)")]
+    if 'intent' not in columns:
+        c.execute("ALTER TABLE messages ADD COLUMN intent TEXT")
+
+    c.execute('''CREATE TABLE IF NOT EXISTS stats_bookings_daily (
+        day TEXT NOT NULL,
+        service TEXT NOT NULL,
+        bookings INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (day, service)
+    ) WITHOUT ROWID''')
+    c.execute('''CREATE TABLE IF NOT EXISTS stats_chat_daily (
+        day TEXT PRIMARY KEY,
+        sessions INTEGER NOT NULL DEFAULT 0,
+        messages INTEGER NOT NULL DEFAULT 0,
+        user_messages INTEGER NOT NULL DEFAULT 0
+    ) WITHOUT ROWID''')
+    c.execute('''CREATE TABLE IF NOT EXISTS stats_session_lengths (
+        user_messages INTEGER PRIMARY KEY,
+        sessions INTEGER NOT NULL DEFAULT 0
+    ) WITHOUT ROWID''')
+    c.execute('''CREATE TABLE IF NOT EXISTS stats_intents (
+        intent TEXT PRIMARY KEY,
+        hits INTEGER NOT NULL DEFAULT 0
+    ) WITHOUT ROWID''')
+
+    c.execute('''CREATE TRIGGER IF NOT EXISTS stats_bookings_insert AFTER INSERT ON bookings BEGIN
+                     INSERT INTO stats_bookings_daily (day, service, bookings)
+                     VALUES (date(new.created_at), new.service, 1)
+                     ON CONFLICT (day, service) DO UPDATE SET bookings = bookings + 1;
+                 END''')
+    c.execute('''CREATE TRIGGER IF NOT EXISTS stats_bookings_delete AFTER DELETE ON bookings BEGIN
+                     UPDATE stats_bookings_daily SET bookings = bookings - 1
+                     WHERE day = date(old.created_at) AND service = old.service;
+                 END''')
+    c.execute('''CREATE TRIGGER IF NOT EXISTS stats_bookings_update AFTER UPDATE OF service, created_at ON bookings BEGIN
+                     UPDATE stats_bookings_daily SET bookings = bookings - 1
+                     WHERE day = date(old.created_at) AND service = old.service;
+                     INSERT INTO stats_bookings_daily (day, service, bookings)
+                     VALUES (date(new.created_at), new.service, 1)
+                     ON CONFLICT (day, service) DO UPDATE SET bookings = bookings + 1;
+                 END''')
+    c.execute('''CREATE TRIGGER IF NOT EXISTS stats_sessions_insert AFTER INSERT ON sessions BEGIN
+                     INSERT INTO stats_chat_daily (day, sessions) VALUES (date(new.created_at), 1)
+                     ON CONFLICT (day) DO UPDATE SET sessions = sessions + 1;
+                     INSERT INTO stats_session_lengths (user_messages, sessions) VALUES (new.user_message_count, 1)
+                     ON CONFLICT (user_messages) DO UPDATE SET sessions = sessions + 1;
+                 END''')
+    c.execute('''CREATE TRIGGER IF NOT EXISTS stats_sessions_count AFTER UPDATE OF user_message_count ON sessions
+                 WHEN new.user_message_count != old.user_message_count BEGIN
+                     UPDATE stats_session_lengths SET sessions = sessions - 1
+                     WHERE user_messages = old.user_message_count;
+                     INSERT INTO stats_session_lengths (user_messages, sessions) VALUES (new.user_message_count, 1)
+                     ON CONFLICT (user_messages) DO UPDATE SET sessions = sessions + 1;
+                 END''')
+    c.execute('''CREATE TRIGGER IF NOT EXISTS stats_sessions_delete AFTER DELETE ON sessions BEGIN
+                     UPDATE stats_session_lengths SET sessions = sessions - 1
+                     WHERE user_messages = old.user_message_count;
+                 END''')
+    c.execute('''CREATE TRIGGER IF NOT EXISTS stats_messages_insert AFTER INSERT ON messages BEGIN
+                     INSERT INTO stats_chat_daily (day, messages, user_messages)
+                     VALUES (date(new.timestamp), 1, new.sender = 'user')
+                     ON CONFLICT (day) DO UPDATE SET messages = messages + 1,
+                                                     user_messages = user_messages + (new.sender = 'user');
+                 END''')
+    c.execute('''CREATE TRIGGER IF NOT EXISTS stats_intents_insert AFTER INSERT ON messages
+                 WHEN new.intent IS NOT NULL BEGIN
+                     INSERT INTO stats_intents (intent, hits) VALUES (new.intent, 1)
+                     ON CONFLICT (intent) DO UPDATE SET hits = hits + 1;
+                 END''')
+    rebuild_stats(c)
+
+IDENTITY_SOURCES = (('admin', "'admin'"), ('employees', 'role'), ('students', 'role'))
+
+def _migration_identities(c):
+    """
+    identities: one row per login (email, role) across admin, employees and
+    students, kept in sync by triggers, so /login is a single primary-key probe.
+    """
+    c.execute('''CREATE TABLE IF NOT EXISTS identities (
+        email TEXT NOT NULL,
+        role TEXT NOT NULL,
+        user_id INTEGER NOT NULL,
+        fname TEXT NOT NULL,
+        lname TEXT NOT NULL,
+        password TEXT NOT NULL,
+        PRIMARY KEY (email, role)
+    ) WITHOUT ROWID''')
+    for table, role in IDENTITY_SOURCES:
+        new_role = role if role.startswith("'") else f"new.{role}"
+        old_role = role if role.startswith("'") else f"old.{role}"
+        upsert = f'''INSERT OR REPLACE INTO identities (email, role, user_id, fname, lname, password)
+                     VALUES (new.email, {new_role}, new.id, new.fname, new.lname, new.password);'''
+        remove = f'''DELETE FROM identities WHERE email = old.email AND role = {old_role} AND user_id = old.id;'''
+        c.execute(f"CREATE TRIGGER IF NOT EXISTS identities_{table}_insert AFTER INSERT ON {table} BEGIN {upsert} END")
+        c.execute(f"CREATE TRIGGER IF NOT EXISTS identities_{table}_update AFTER UPDATE ON {table} BEGIN {remove} {upsert} END")
+        c.execute(f"CREATE TRIGGER IF NOT EXISTS identities_{table}_delete AFTER DELETE ON {table} BEGIN {remove} END")
+        c.execute(f'''INSERT OR REPLACE INTO identities (email, role, user_id, fname, lname, password)
+                      SELECT email, {role}, id, fname, lname, password FROM {table}''')
+
+def _migration_slots(c):
+    """
+    Slot inventory for /booking: capacity per (service, start time) and the seats
+    still free, kept by the reservation itself and given back by a trigger when a
+    booking is deleted.
+    """
+    c.execute('''CREATE TABLE IF NOT EXISTS slots (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        service TEXT NOT NULL,
+        starts_at TIMESTAMP NOT NULL,
+        capacity INTEGER NOT NULL CHECK (capacity >= 0),
+        remaining INTEGER NOT NULL CHECK (remaining >= 0 AND remaining <= capacity),
+        UNIQUE (service, starts_at)
+    )''')
+    columns = [row['name'] for row in c.execute("PRAGMA table_info(bookings)")]
+    if 'slot_id' not in columns:
+        c.execute("ALTER TABLE bookings ADD COLUMN slot_id INTEGER REFERENCES slots (id)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_bookings_slot ON bookings (slot_id)")
+    c.execute('''CREATE TRIGGER IF NOT EXISTS slots_release AFTER DELETE ON bookings
+                 WHEN old.slot_id IS NOT NULL BEGIN
+                     UPDATE slots SET remaining = remaining + 1 WHERE id = old.slot_id;
+                 END''')
+
+def _migration_notices_version(c):
+    """
+    cache_versions: a version counter per cached table, bumped by triggers on
+    every write, so each process can tell whether its cached copy is current.
+    """
+    c.execute('''CREATE TABLE IF NOT EXISTS cache_versions (
+        name TEXT PRIMARY KEY,
+        version INTEGER NOT NULL DEFAULT 0,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    ) WITHOUT ROWID''')
+    c.execute("INSERT OR IGNORE INTO cache_versions (name, version) VALUES ('notices', 1)")
+    for event in ('INSERT', 'UPDATE', 'DELETE'):
+        c.execute(f'''CREATE TRIGGER IF NOT EXISTS notices_version_{event.lower()} AFTER {event} ON notices BEGIN
+                          UPDATE cache_versions SET version = version + 1, updated_at = CURRENT_TIMESTAMP
+                          WHERE name = 'notices';
+                      END''')
+
+def _migration_booking_accounts(c):
+    """
+    bookings.account_role/account_id: the student or employee account a booking
+    belongs to, instead of matching on first and last name. Existing bookings are
+    linked only where the name (within the booking's classification) matches
+    exactly one account; ambiguous and unknown names stay unlinked.
+    """
+    columns = [row['name'] for row in c.execute("PRAGMA table_info(bookings)")]
+    if 'account_role' not in columns:
+        c.execute("ALTER TABLE bookings ADD COLUMN account_role TEXT")
+    if 'account_id' not in columns:
+        c.execute("ALTER TABLE bookings ADD COLUMN account_id INTEGER")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_bookings_account ON bookings (account_role, account_id, slot)")
+    for role, table in (('employee', 'employees'), ('student', 'students')):
+        c.execute(f'''UPDATE bookings
+                      SET account_role = ?,
+                          account_id = (SELECT a.id FROM {table} a
+                                        WHERE a.fname = bookings.fname AND a.lname = bookings.lname)
+                      WHERE account_id IS NULL AND classification = ?
+                        AND (SELECT COUNT(*) FROM {table} a
+                             WHERE a.fname = bookings.fname AND a.lname = bookings.lname) = 1''',
+                  (role, role))
+
+def _migration_drop_unused_indexes(c):
+    """Drop idx_bookings_name_slot: dashboards look bookings up by account, and idx_bookings_name covers the rest"""
+    c.execute("DROP INDEX IF EXISTS idx_bookings_name_slot")
+
+MIGRATIONS = [
+    _migration_session_message_count,
+    _migration_indexes,
+    _migration_bookings_alphabetical_index,
+    _migration_messages_fts,
+    _migration_stats_tables,
+    _migration_identities,
+    _migration_slots,
+    _migration_notices_version,
+    _migration_booking_accounts,
+    _migration_drop_unused_indexes,
+]
+
+def migrate_db(conn):
+    """Apply pending migrations, each in its own transaction. Safe to run from several workers at once."""
+    c = conn.cursor()
+    for version, migration in enumerate(MIGRATIONS, start=1):
+        if c.execute("PRAGMA user_version").fetchone()[0] >= version:
+            continue
+        c.execute("BEGIN IMMEDIATE")
+        try:
+            # Re-check under the write lock in case another process got here first
+            if c.execute("PRAGMA user_version").fetchone()[0] < version:
+                migration(c)
+                c.execute(f"PRAGMA user_version = {version}")
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
+# Everything a student/employee dashboard shows, as one JSON document: profile,
+# upcoming bookings (slot bookings from now on, plus free-form ones) and notice headers
+DASHBOARD_QUERY = '''
+SELECT json_object(
+    'profile', (SELECT json_object('id', id, 'fname', fname, 'lname', lname, 'email', email,
+                                   'role', role, 'created_at', created_at)
+                FROM {table} WHERE id = :user_id),
+    'bookings', (SELECT json_group_array(json_object('id', id, 'fname', fname, 'lname', lname,
+                                                     'classification', classification, 'service', service,
+                                                     'slot', slot, 'slot_id', slot_id, 'created_at', created_at))
+                 FROM (SELECT * FROM bookings
+                       WHERE account_role = :role AND account_id = :user_id
+                         AND (slot_id IS NULL OR slot >= datetime('now'))
+                       ORDER BY slot LIMIT :bookings)),
+    'notices', (SELECT json_group_array(json_object('id', id, 'title', title, 'created_at', created_at,
+                                                    'summary', substr(content, 1, :summary)))
+                FROM (SELECT id, title, content, created_at FROM notices
+                      ORDER BY created_at DESC, id DESC LIMIT :notices)),
+    'notices_version', (SELECT version FROM cache_versions WHERE name = 'notices')
+)'''
+
+# Admin list pages. The endpoints fill {where} with their filters (where_clause)
+# and HOT_QUERIES checks the same text, so the plans checked are the ones served.
+ADMIN_MESSAGES_QUERY = '''
+SELECT m.id, m.session_id, m.sender, m.content, m.timestamp, u.full_name
+FROM messages m
+LEFT JOIN sessions s ON m.session_id = s.session_id
+LEFT JOIN users u ON s.user_id = u.id
+{where}
+ORDER BY m.timestamp DESC, m.id DESC LIMIT ?'''
+# Keyset: the next page starts after the (timestamp, id) of the last row
+ADMIN_MESSAGES_AFTER = "(m.timestamp, m.id) < (?, ?)"
+# ?q= on the list pages when FTS5 is available
+MESSAGE_FTS_FILTER = "m.id IN (SELECT rowid FROM messages_fts WHERE messages_fts MATCH ?)"
+
+MESSAGE_SEARCH_QUERY = '''
+SELECT m.id, m.session_id, m.sender, m.content, m.timestamp, u.full_name,
+       bm25(messages_fts) AS score
+FROM messages_fts
+JOIN messages m ON m.id = messages_fts.rowid
+LEFT JOIN sessions s ON m.session_id = s.session_id
+LEFT JOIN users u ON s.user_id = u.id
+{where}
+ORDER BY messages_fts.rowid DESC LIMIT ?'''
+MESSAGE_SEARCH_MATCH = "messages_fts MATCH ?"
+# Search pages on id, not on score: bm25 depends on index-wide statistics, so a
+# message's score moves as others are added or deleted and a score cursor would
+# skip or repeat rows
+MESSAGE_SEARCH_AFTER = "messages_fts.rowid < ?"
+
+ADMIN_BOOKINGS_QUERY = '''
+SELECT id, fname, lname, classification, service, slot, created_at FROM bookings
+{where}
+ORDER BY {order} LIMIT ?'''
+# ?sort= -> (key columns, keyset clause, ORDER BY)
+BOOKING_SORTS = {
+    'recent': (('created_at', 'id'), "(created_at, id) < (?, ?)", "created_at DESC, id DESC"),
+    'alphabetical': (('fname', 'lname', 'id'), "(fname, lname, id) > (?, ?, ?)",
+                     "fname ASC, lname ASC, id ASC"),
+}
+
+def where_clause(filters):
+    """'WHERE a AND b' for a list of conditions ('' when there are none)."""
+    return f"WHERE {' AND '.join(filters)}" if filters else ''
+
+# Queries on the hot paths, checked with EXPLAIN QUERY PLAN by `flask check-query-plans`.
+# Each is the text an endpoint runs, with a representative set of filters.
+HOT_QUERIES = {
+    'chat_quota': ("SELECT user_message_count FROM sessions WHERE session_id = ?", ('x',)),
+    'admin_messages_page': (ADMIN_MESSAGES_QUERY.format(where=where_clause([ADMIN_MESSAGES_AFTER])),
+                            ('2100-01-01', 1, 51)),
+    'admin_messages_by_session': (ADMIN_MESSAGES_QUERY.format(where=where_clause(
+                                      ["m.session_id = ?", "m.sender = ?", ADMIN_MESSAGES_AFTER])),
+                                  ('x', 'user', '2100-01-01', 1, 51)),
+    'admin_messages_by_date': (ADMIN_MESSAGES_QUERY.format(where=where_clause(
+                                   ["m.timestamp >= date(?)", "m.timestamp < date(?, '+1 day')"])),
+                               ('2025-01-01', '2025-01-31', 51)),
+    'admin_messages_text': (ADMIN_MESSAGES_QUERY.format(where=where_clause([MESSAGE_FTS_FILTER])),
+                            ('"library"*', 51)),
+    'message_search': (MESSAGE_SEARCH_QUERY.format(where=where_clause(
+                           [MESSAGE_SEARCH_MATCH, "m.sender = ?", MESSAGE_SEARCH_AFTER])),
+                       ('"library"*', 'user', 100, 51)),
+    'admin_bookings_page': (ADMIN_BOOKINGS_QUERY.format(where=where_clause([BOOKING_SORTS['recent'][1]]),
+                                                        order=BOOKING_SORTS['recent'][2]),
+                            ('2100-01-01', 1, 51)),
+    'admin_bookings_alphabetical_page': (ADMIN_BOOKINGS_QUERY.format(
+                                             where=where_clause([BOOKING_SORTS['alphabetical'][1]]),
+                                             order=BOOKING_SORTS['alphabetical'][2]),
+                                         ('a', 'b', 1, 51)),
+    'admin_bookings_by_service': (ADMIN_BOOKINGS_QUERY.format(
+                                      where=where_clause(["service IN (?,?)", BOOKING_SORTS['recent'][1]]),
+                                      order=BOOKING_SORTS['recent'][2]),
+                                  ('a', 'b', '2100-01-01', 1, 51)),
+    'notices': ("SELECT id, title, content, created_at FROM notices ORDER BY created_at DESC, id DESC", ()),
+    'notices_version': ("SELECT version, updated_at FROM cache_versions WHERE name = 'notices'", ()),
+    'slot_availability': ('''SELECT id, service, starts_at, capacity, remaining FROM slots
+                             WHERE service = ? AND starts_at >= ? AND remaining > 0
+                             ORDER BY starts_at LIMIT 50''', ('it', '2025-01-01')),
+    'login': ("SELECT role, user_id, fname, lname, password FROM identities WHERE email = ?", ('x',)),
+    'dashboard': (DASHBOARD_QUERY.format(table='students'),
+                  {'role': 'student', 'user_id': 1, 'bookings': 50, 'notices': 10, 'summary': 200}),
+}
+
+def has_message_fts(conn):
+    """Whether the messages_fts index exists (SQLite may be built without FTS5)."""
+    return conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'messages_fts'").fetchone() is not None
+
+def fts_query(text):
+    """
+    FTS5 MATCH expression for free text typed by a user: every word must appear
+    (the last one as a prefix, for search-as-you-type). Words are quoted, so FTS5
+    operators and punctuation in the input are never interpreted.
+    Returns None when the text has no searchable words.
+    """
+    words = re.findall(r'\w+', text)
+    if not words:
+        return None
+    return ' '.join(f'"{word}"' for word in words) + '*'
+
+def text_matches(text, content):
+    """
+    fts_query's rule applied to one message, for archives (which have no FTS index):
+    every word of text must start a word of content, ignoring case. FTS5's porter
+    stemmer is not reproduced; matching every word as a prefix stands in for it, so
+    'question' finds 'questions' in both, though the archive also accepts e.g.
+    'questionnaire' where the index would not.
+    """
+    tokens = re.findall(r'\w+', content.lower())
+    return all(any(token.startswith(word) for token in tokens)
+               for word in re.findall(r'\w+', text.lower()))
+
+def encode_cursor(values):
+    """Opaque keyset-pagination cursor holding the sort key of the last row of a page."""
+    return base64.urlsafe_b64encode(json.dumps(values).encode('utf-8')).decode('ascii').rstrip('=')
+
+def decode_cursor(cursor):
+    """Inverse of encode_cursor; raises ValueError for anything malformed."""
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+    except (ValueError, TypeError) as e:
+        raise ValueError(f"Invalid cursor: {e}")
+    if not isinstance(values, list):
+        raise ValueError("Invalid cursor")
+    return values
+
+def explain_hot_queries(conn):
+    """
+    {name: (plan lines, full_scans)} for HOT_QUERIES, where full_scans lists the
+    plan steps that scan a table without an index (FTS5 lookups show up as a
+    SCAN of the virtual table, and subqueries as a SCAN of their own result;
+    neither is counted).
+    """
+    report = {}
+    for name, (sql, params) in HOT_QUERIES.items():
+        plan = [row['detail'] for row in conn.execute(f"EXPLAIN QUERY PLAN {sql}", params)]
+        full_scans = [step for step in plan
+                      if step.startswith('SCAN ') and 'USING' not in step and 'CONSTANT ROW' not in step
+                      and 'VIRTUAL TABLE' not in step and not step.startswith('SCAN (subquery')]
+        report[name] = (plan, full_scans)
+    return report
+
+#---------------------------------------------
+# Notices cache
+#---------------------------------------------
+NoticesSnapshot = namedtuple('NoticesSnapshot', 'version notices etag last_modified')
+
+class NoticesCache:
+    """
+    In-process copy of the notices list, newest first.
+
+    Every write to notices bumps the 'notices' row of cache_versions (triggers),
+    so a process only re-reads the list when that version moved. The version row
+    itself is rechecked at most every recheck_seconds; writes made through this
+    process call invalidate() and are seen immediately.
+    """
+    def __init__(self, recheck_seconds=2.0):
+        self.recheck = float(recheck_seconds)
+        self._lock = threading.Lock()
+        self._snapshot = None
+        self._checked = 0.0
+        self.hits = 0
+        self.reloads = 0
+
+    def get(self):
+        now = time.monotonic()
+        with self._lock:
+            snapshot = self._snapshot
+            if snapshot is not None and now - self._checked < self.recheck:
+                self.hits += 1
+                return snapshot
+
+        conn = get_db()
+        try:
+            row = conn.execute("SELECT version, updated_at FROM cache_versions WHERE name = 'notices'").fetchone()
+            if snapshot is None or snapshot.version != row['version']:
+                notices = tuple(dict(r) for r in conn.execute(
+                    "SELECT id, title, content, created_at FROM notices ORDER BY created_at DESC, id DESC"))
+                last_modified = datetime.strptime(row['updated_at'], '%Y-%m-%d %H:%M:%S').replace(tzinfo=timezone.utc)
+                snapshot = NoticesSnapshot(row['version'], notices, f"notices-{row['version']}", last_modified)
+                with self._lock:
+                    self.reloads += 1
+        finally:
+            conn.close()
+
+        with self._lock:
+            self._snapshot = snapshot
+            self._checked = now
+        return snapshot
+
+    def invalidate(self):
+        with self._lock:
+            self._checked = 0.0
+
+    def stats(self):
+        with self._lock:
+            return {
+                'version': self._snapshot.version if self._snapshot else None,
+                'hits': self.hits,
+                'reloads': self.reloads,
+            }
+
+notices_cache = NoticesCache(recheck_seconds=float(os.environ.get('UOK_NOTICES_RECHECK_SECONDS', 2)))
+
+#---------------------------------------------
+# Personal dashboard
+#---------------------------------------------
+DASHBOARD_ACCOUNT_TABLES = {'employee': 'employees', 'student': 'students'}
+DASHBOARD_BOOKINGS = 50
+DASHBOARD_NOTICES = 10
+DASHBOARD_SUMMARY_CHARS = 200
+
+def dashboard_json(conn, role, user_id):
+    """
+    The dashboard payload for a student or employee as a JSON string, built by
+    SQLite in a single query (see DASHBOARD_QUERY). 'profile' is null if the
+    account does not exist.
+    """
+    sql = DASHBOARD_QUERY.format(table=DASHBOARD_ACCOUNT_TABLES[role])
+    return conn.execute(sql, {'role': role, 'user_id': user_id, 'bookings': DASHBOARD_BOOKINGS,
+                              'notices': DASHBOARD_NOTICES, 'summary': DASHBOARD_SUMMARY_CHARS}).fetchone()[0]
+
+#---------------------------------------------
+# Login: identity lookup and password checks
+#---------------------------------------------
+LOGIN_ROLE_ORDER = ('admin', 'employee', 'student')
+
+class LoginBusy(Exception):
+    """More logins are waiting for a password check than the verifier accepts."""
+
+def find_identities(conn, email):
+    """Accounts that sign in with this email (one primary-key probe), admin first."""
+    rows = conn.execute("SELECT role, user_id, fname, lname, password FROM identities WHERE email = ?",
+                        (email,)).fetchall()
+    return sorted(rows, key=lambda row: LOGIN_ROLE_ORDER.index(row['role'])
+                  if row['role'] in LOGIN_ROLE_ORDER else len(LOGIN_ROLE_ORDER))
+
+class PasswordVerifier:
+    """
+    Runs check_password_hash (a deliberately slow KDF) on a small thread pool.
+
+    At most max_workers hashes run at once, so a burst of logins cannot take every
+    CPU from the chat requests served by the same worker. At most max_pending
+    logins may be in progress per process; admission never waits, verify() raises
+    LoginBusy at once when they are all taken. Keep max_pending below the request
+    threads per worker, so logins can never occupy every thread chat needs.
+    """
+    def __init__(self, max_workers=1, max_pending=2):
+        self.max_pending = max(1, int(max_pending))
+        self.max_workers = max(1, min(int(max_workers), self.max_pending))
+        self._slots = threading.BoundedSemaphore(self.max_pending)
+        self._lock = threading.Lock()
+        self._pid = None
+        self._pool = None
+        self._in_flight = 0
+        self.checks = 0
+        self.rejected = 0
+        self._time = 0.0
+
+    def _executor(self):
+        # Pool threads do not survive a fork, so each process creates its own
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._pool = ThreadPoolExecutor(max_workers=self.max_workers,
+                                                    thread_name_prefix='password-check')
+                    self._pid = os.getpid()
+        return self._pool
+
+    def verify(self, pwhash, password):
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self.rejected += 1
+            raise LoginBusy()
+        started = time.perf_counter()
+        with self._lock:
+            self._in_flight += 1
+        try:
+            return self._executor().submit(check_password_hash, pwhash, password).result()
+        finally:
+            self._slots.release()
+            with self._lock:
+                self._in_flight -= 1
+                self.checks += 1
+                self._time += time.perf_counter() - started
+
+    def stats(self):
+        with self._lock:
+            return {
+                'checks': self.checks,
+                'rejected_busy': self.rejected,
+                'in_flight': self._in_flight,
+                'avg_ms': round(self._time * 1000 / self.checks, 3) if self.checks else 0.0,
+                'max_workers': self.max_workers,
+                'max_pending': self.max_pending,
+            }
+
+# Logins in progress may take at most half the request threads of a worker (UOK_THREADS
+# is the gthread count serve.py configures); the rest are always left for chat
+_REQUEST_THREADS = int(os.environ.get('UOK_THREADS', 4))
+password_verifier = PasswordVerifier(
+    max_workers=int(os.environ.get('UOK_LOGIN_WORKERS', 1)),
+    max_pending=int(os.environ.get('UOK_LOGIN_MAX_PENDING', max(1, _REQUEST_THREADS // 2))),
+)
+
+def authenticate(conn, email, password):
+    """The identities row whose password matches, None if none does; may raise LoginBusy."""
+    for identity in find_identities(conn, email):
+        if password_verifier.verify(identity['password'], password):
+            return identity
+    return None
+
 #---------------------------------------------
 # Auto-generate email and password
 #---------------------------------------------
@@ -237,73 +1451,991 @@ def create_student(fname, lname):
 
     return {'id': user_id, 'email': email, 'password': password}
 
+#---------------------------------------------
+# Bulk provisioning
+#---------------------------------------------
+PROVISION_TABLES = {'employee': 'employees', 'student': 'students'}
+PROVISION_CHUNK_SIZE = int(os.environ.get('UOK_PROVISION_CHUNK_SIZE', 500))
+PROVISION_WORKERS = int(os.environ.get('UOK_PROVISION_WORKERS', os.cpu_count() or 1))
+
+def _hash_password(password):
+    # Module-level so the process pool can pickle it
+    return generate_password_hash(password)
+
+_hash_pool = None
+_hash_pool_pid = None
+_hash_pool_lock = threading.Lock()
+
+def hash_pool():
+    """
+    The process pool provisioning hashes passwords in: started on first use and
+    kept for the life of the process (one per worker), since spawning a pool per
+    request costs a fresh interpreter per child.
+    """
+    global _hash_pool, _hash_pool_pid
+    with _hash_pool_lock:
+        if _hash_pool is None or _hash_pool_pid != os.getpid():
+            # spawn: forking a process that runs server threads is not safe
+            _hash_pool = ProcessPoolExecutor(max_workers=max(1, PROVISION_WORKERS),
+                                             mp_context=multiprocessing.get_context('spawn'))
+            _hash_pool_pid = os.getpid()
+        return _hash_pool
+
+def _discard_hash_pool(pool):
+    global _hash_pool
+    with _hash_pool_lock:
+        if _hash_pool is pool:
+            _hash_pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+@atexit.register
+def _stop_hash_pool():
+    if _hash_pool is not None and _hash_pool_pid == os.getpid():
+        _hash_pool.shutdown(wait=False, cancel_futures=True)
+
+def parse_people(text, fmt):
+    """
+    [(fname, lname)] from CSV (a header row naming fname and lname columns) or a
+    JSON list of {"fname", "lname"} objects. Raises ValueError naming the bad rows.
+    """
+    if fmt == 'json':
+        records = json.loads(text)
+        if not isinstance(records, list):
+            raise ValueError("Expected a JSON list of people")
+    elif fmt == 'csv':
+        records = list(csv.DictReader(io.StringIO(text)))
+    else:
+        raise ValueError(f"Unsupported format: {fmt}")
+
+    people, bad = [], []
+    for number, record in enumerate(records, start=1):
+        fname = lname = ''
+        if isinstance(record, dict):
+            fname = str(record.get('fname') or '').strip()
+            lname = str(record.get('lname') or '').strip()
+        if fname and lname:
+            people.append((fname, lname))
+        else:
+            bad.append(number)
+    if bad:
+        raise ValueError(f"First and last name required (records {', '.join(map(str, bad[:20]))}"
+                         f"{', ...' if len(bad) > 20 else ''})")
+    return people
+
+def _next_id(conn, table):
+    # What AUTOINCREMENT would hand out next
+    return conn.execute(f'''SELECT MAX(COALESCE((SELECT seq FROM sqlite_sequence WHERE name = ?), 0),
+                                       COALESCE((SELECT MAX(id) FROM {table}), 0)) + 1''',
+                        (table,)).fetchone()[0]
+
+def provision_accounts(role, people, chunk_size=PROVISION_CHUNK_SIZE):
+    """
+    Create accounts for many people at once, yielding
+    {'id', 'fname', 'lname', 'email', 'password'} as each chunk is committed.
+
+    Credentials derive from the row id (as in create_employee/create_student), so
+    each chunk optimistically takes the next free ids, hashes the passwords in
+    hash_pool() without holding the write lock, then inserts the whole chunk with
+    one executemany - unless another writer took those ids meanwhile, in which case
+    the chunk is redone with fresh ids.
+
+    Chunks commit one at a time: if one fails, the accounts already yielded stay
+    created and the error is raised to the caller.
+    """
+    table = PROVISION_TABLES[role]
+    pool = hash_pool()
+    conn = get_db()
+    try:
+        for start in range(0, len(people), chunk_size):
+            chunk = people[start:start + chunk_size]
+            for attempt in range(5):
+                first_id = _next_id(conn, table)
+                accounts = [{'id': first_id + i, 'fname': fname, 'lname': lname,
+                             'email': f"{first_id + i}-{lname}@UoK.ac.za",
+                             'password': f"{first_id + i}@{lname}"}
+                            for i, (fname, lname) in enumerate(chunk)]
+                try:
+                    hashes = list(pool.map(_hash_password, [a['password'] for a in accounts],
+                                           chunksize=max(1, len(accounts) // (PROVISION_WORKERS * 4))))
+                except BrokenProcessPool:
+                    # A child died; start a fresh pool for the next provisioning run
+                    _discard_hash_pool(pool)
+                    raise
+                conn.execute('BEGIN IMMEDIATE')
+                try:
+                    if _next_id(conn, table) != first_id:
+                        conn.rollback()
+                        continue
+                    conn.executemany(f'''INSERT INTO {table} (id, fname, lname, email, password, role)
+                                         VALUES (?, ?, ?, ?, ?, ?)''',
+                                     [(a['id'], a['fname'], a['lname'], a['email'], hashed, role)
+                                      for a, hashed in zip(accounts, hashes)])
+                    conn.commit()
+                except Exception:
+                    conn.rollback()
+                    raise
+                break
+            else:
+                raise RuntimeError(f"Could not reserve ids in {table}: too many concurrent inserts")
+            yield from accounts
+    finally:
+        conn.close()
+
+#---------------------------------------------
+# Static asset pipeline (fingerprinted, precompressed)
+#---------------------------------------------
+STATIC_DIR = 'static'
+ASSET_DIR = os.environ.get('UOK_ASSET_DIR', os.path.join(STATIC_DIR, 'dist'))
+ASSET_MANIFEST = 'manifest.json'
+ASSET_EXTENSIONS = ('.css', '.js')
+
+# Encodings the asset route can serve, most preferred first
+ASSET_ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+# Relative url(...) references inside CSS; they must keep pointing at /static/
+# once the stylesheet itself is served from /assets/
+_CSS_URL = re.compile(r'''url\(\s*(['"]?)(?![a-z]+:|/|#)([^'")]+)\1\s*\)''', re.IGNORECASE)
+
+_asset_manifest = (None, {}, ('none', None))
+
+def build_assets(static_dir=STATIC_DIR, out_dir=ASSET_DIR, prune=False):
+    """
+    Write a content-hashed copy of every CSS/JS file in static_dir to out_dir
+    (style.css -> style.<hash>.css), plus .gz and, when the brotli package is
+    installed, .br variants. Returns the manifest {logical name: hashed name},
+    which is also written to out_dir/manifest.json for asset_url().
+    """
+    try:
+        import brotli
+    except ImportError:
+        brotli = None
+    encoders = [('', lambda data: data), ('.gz', lambda data: gzip.compress(data, 9, mtime=0))]
+    if brotli is not None:
+        encoders.append(('.br', lambda data: brotli.compress(data, quality=11)))
+    os.makedirs(out_dir, exist_ok=True)
+    manifest = {}
+    for root, dirs, files in os.walk(static_dir):
+        if os.path.abspath(root).startswith(os.path.abspath(out_dir)):
+            continue
+        for name in sorted(files):
+            stem, ext = os.path.splitext(name)
+            if ext not in ASSET_EXTENSIONS:
+                continue
+            with open(os.path.join(root, name), 'rb') as f:
+                data = f.read()
+            logical = os.path.relpath(os.path.join(root, name), static_dir).replace(os.sep, '/')
+            if ext == '.css':
+                base = posixpath.dirname(logical)
+                data = _CSS_URL.sub(
+                    lambda m: f"url({m.group(1)}/static/{posixpath.normpath(posixpath.join(base, m.group(2)))}{m.group(1)})",
+                    data.decode('utf-8')).encode('utf-8')
+            hashed = os.path.join(os.path.dirname(logical), f"{stem}.{hashlib.sha256(data).hexdigest()[:12]}{ext}")
+            hashed = hashed.replace(os.sep, '/')
+            target = os.path.join(out_dir, hashed)
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+
+            # Content-addressed: an existing file with this name already has these bytes
+            for suffix, encode in encoders:
+                path = target + suffix
+                if not os.path.exists(path):
+                    with open(path + '.tmp', 'wb') as f:
+                        f.write(encode(data))
+                    os.replace(path + '.tmp', path)
+            manifest[logical] = hashed
+
+    if prune:
+        keep = {ASSET_MANIFEST}
+        for hashed in manifest.values():
+            keep.update(hashed + suffix for suffix in ('', '.gz', '.br'))
+        for root, dirs, files in os.walk(out_dir):
+            for name in files:
+                path = os.path.join(root, name)
+                if os.path.relpath(path, out_dir).replace(os.sep, '/') not in keep:
+                    os.remove(path)
+
+    manifest_path = os.path.join(out_dir, ASSET_MANIFEST)
+    with open(manifest_path + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(manifest_path + '.tmp', manifest_path)
+    return manifest
+
+def _load_asset_manifest():
+    global _asset_manifest
+    path = os.path.join(ASSET_DIR, ASSET_MANIFEST)
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        _asset_manifest = (None, {}, ('none', None))
+        return _asset_manifest
+    if _asset_manifest[0] != mtime:
+        with open(path, 'rb') as f:
+            raw = f.read()
+        built_at = datetime.fromtimestamp(mtime // 10**9, timezone.utc)
+        _asset_manifest = (mtime, json.loads(raw), (hashlib.sha256(raw).hexdigest()[:12], built_at))
+    return _asset_manifest
+
+def asset_manifest():
+    """The manifest written by build_assets(), reloaded when the file changes ({} before a build)."""
+    return _load_asset_manifest()[1]
+
+def asset_build():
+    """
+    (build id, build time) of the current manifest, ('none', None) before a build.
+    Pages that link assets through asset_url() must fold these into their
+    validators, or a 304 could keep serving HTML that points at old hashes.
+    """
+    return _load_asset_manifest()[2]
+
+def asset_url(filename):
+    """URL of the fingerprinted copy of a static file, or the plain /static URL if it has none."""
+    hashed = asset_manifest().get(filename)
+    if hashed is None:
+        return url_for('static', filename=filename)
+    return url_for('assets', filename=hashed)
+
 #=============================================
 # ChatBot AI Handling
 #=============================================
-def load_intents():
+INTENTS_PATH = 'model/intents.json'
+
+FALLBACK_RESPONSES = [
+    "I'm not sure about that. Can you try asking about applications, fees, or general university information?",
+    "I didn't quite understand. Would you like to know about university applications or student fees?",
+    "Could you rephrase that? I can help with information about university applications, fees, and general inquiries."
+]
+
+def load_intents(path=INTENTS_PATH):
     try:
-        with open('model/intents.json', 'r') as file:
+        with open(path, 'r') as file:
             return json.load(file)
     except FileNotFoundError:
         return {"intents": []}
 
+def _compile_pattern(pattern):
+    """Lower-case a pattern and make sure it compiles (escape it if it does not)."""
+    pattern = pattern.lower()
+    try:
+        re.compile(pattern)
+    except re.error:
+        pattern = re.escape(pattern)
+    return pattern
+
+class IntentMatcher:
+    """
+    Pre-built index over the patterns in intents.json.
+
+    One alternation regex over every pattern rejects misses in a single search;
+    hits are resolved against one compiled alternation per intent, in file order,
+    so the first intent that matches still wins. The index is rebuilt whenever the
+    mtime of the intents file changes.
+    """
+    def __init__(self, path=INTENTS_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._mtime = None
+        self._index = None
+
+    def _current_mtime(self):
+        try:
+            return os.stat(self.path).st_mtime_ns
+        except OSError:
+            return None
+
+    def version(self):
+        """Changes whenever intents.json does (the index is rebuilt for it on next use)."""
+        return self._current_mtime()
+
+    def _build(self, intents):
+        rules = []
+        responses = {}
+        all_patterns = []
+        for intent in intents.get('intents', []):
+            tag = intent.get('tag')
+            replies = intent.get('responses') or ['I understand.']
+            responses.setdefault(tag, replies)
+
+            patterns = [_compile_pattern(p) for p in intent.get('patterns', [])]
+            if not patterns:
+                continue
+            all_patterns.extend(patterns)
+            rules.append((tag, re.compile('|'.join(f'(?:{p})' for p in patterns))))
+
+        any_pattern = re.compile('|'.join(f'(?:{p})' for p in all_patterns)) if all_patterns else None
+        return any_pattern, rules, responses
+
+    def index(self):
+        """Return (any_pattern, rules, responses), rebuilding if intents.json changed."""
+        mtime = self._current_mtime()
+        if self._index is None or mtime != self._mtime:
+            with self._lock:
+                if self._index is None or mtime != self._mtime:
+                    self._index = self._build(load_intents(self.path))
+                    self._mtime = mtime
+        return self._index
+
+    def match(self, text):
+        """Return the tag of the first intent with a pattern found in text, or None."""
+        any_pattern, rules, _ = self.index()
+        text_lower = text.lower()
+        if any_pattern is None or not any_pattern.search(text_lower):
+            return None
+        for tag, pattern in rules:
+            if pattern.search(text_lower):
+                return tag
+        return None
+
+    def responses(self):
+        """tag -> list of responses"""
+        return self.index()[2]
+
+intent_matcher = IntentMatcher()
+
+def normalize_utterance(text):
+    """Lower-case and collapse whitespace, so trivially different messages share a cache key."""
+    return ' '.join(text.lower().split())
+
+def match_intent(text):
+    """Pattern-match text to an intent tag (or None), going through the classification cache."""
+    utterance = normalize_utterance(text)
+    key = ('pattern', utterance)
+    generation = classification_cache.generation()
+    cached = classification_cache.get(key)
+    if cached is not None:
+        return cached[0]
+
+    tag = intent_matcher.match(utterance)
+    classification_cache.put(key, (tag, 1.0 if tag is not None else 0.0), generation)
+    return tag
+
 def bot_reply(text):
-    intents = load_intents()
-    text_lower = text.lower()
-
-    for intent in intents.get('intents', []):
-        for pattern in intent.get('patterns', []):
-            # use regex search for flexible matching
-            if re.search(pattern.lower(), text_lower):
-                return random.choice(intent.get('responses', ['I understand.']))
-
-    # Fallback responses
-    fallback_responses = [
-        "I'm not sure about that. Can you try asking about applications, fees, or general university information?",
-        "I didn't quite understand. Would you like to know about university applications or student fees?",
-        "Could you rephrase that? I can help with information about university applications, fees, and general inquiries."
-    ]
-    return random.choice(fallback_responses)
+    return chat_pipeline.route(text)['response']
+
+_lemmatizer = None
 
 def clean_up_sentence(sentence):
-    lemmatizer = WordNetLemmatizer()
+    global _lemmatizer
+    import nltk
+    if _lemmatizer is None:
+        from nltk.stem import WordNetLemmatizer
+        _lemmatizer = WordNetLemmatizer()
+
     sentence_words = nltk.word_tokenize(sentence)
-    sentence_words = [lemmatizer.lemmatize(word) for word in sentence_words]
+    sentence_words = [_lemmatizer.lemmatize(word) for word in sentence_words]
     return sentence_words
 
+class BagOfWords:
+    """
+    Bag-of-words featurizer built once from the vocab in words.pkl.
+
+    Tokens are looked up in a word -> index dict, so the cost of a sentence grows
+    with its length rather than with the size of the vocab.
+    """
+    def __init__(self, words, tokenizer=None):
+        self.words = list(words)
+        self.index = {word: i for i, word in enumerate(self.words)}
+        self.tokenizer = tokenizer
+
+    def __len__(self):
+        return len(self.words)
+
+    def indices(self, sentence, tokenized=False):
+        """Sorted vocab indices of the words present in sentence (sparse form)."""
+        tokens = sentence if tokenized else (self.tokenizer or clean_up_sentence)(sentence)
+        return np.array(sorted({self.index[w] for w in tokens if w in self.index}), dtype=np.intp)
+
+    def transform(self, sentence, dtype=np.uint8, sparse=False):
+        if sparse:
+            return self.indices(sentence)
+        bag = np.zeros(len(self.words), dtype=dtype)
+        bag[self.indices(sentence)] = 1
+        return bag
+
+    def transform_batch(self, sentences, dtype=np.float32, tokenized=False):
+        """(N x V) matrix with one bag of words per sentence (or per token list if tokenized)."""
+        bags = np.zeros((len(sentences), len(self.words)), dtype=dtype)
+        for row, sentence in enumerate(sentences):
+            bags[row, self.indices(sentence, tokenized)] = 1
+        return bags
+
 def bag_of_words(sentence):
-    words = pickle.load(open('model/words.pkl', 'rb'))
-    sentence_words = clean_up_sentence(sentence)
-    bag = [0] * len(words)
-    for w in sentence_words:
-        for i, word in enumerate(words):
-            if word == w:
-                bag[i] = 1
-    return np.array(bag)
+    return inference_engine.load().featurizer.transform(sentence)
 
-def predict_class(sentence):
-    classes = pickle.load(open('model/classes.pkl', 'rb'))
-    model = load_model('model/chatbot_model.keras')
+#---------------------------------------------
+# Resident inference engine
+#---------------------------------------------
+MODEL_PATH = 'model/chatbot_model.keras'
+WORDS_PATH = 'model/words.pkl'
+CLASSES_PATH = 'model/classes.pkl'
+BUNDLE_PATH = 'model/chatbot_bundle.bin'
+ERROR_THRESHOLD = float(os.environ.get('UOK_ERROR_THRESHOLD', 0.25))
+
+_ACTIVATIONS = {
+    'linear': lambda x: x,
+    'relu': lambda x: np.maximum(x, 0),
+    'sigmoid': lambda x: 1 / (1 + np.exp(-x)),
+    'tanh': np.tanh,
+}
+
+def _softmax(x):
+    e = np.exp(x - x.max(axis=-1, keepdims=True))
+    return e / e.sum(axis=-1, keepdims=True)
+
+_ACTIVATIONS['softmax'] = _softmax
 
-    bow = bag_of_words(sentence)
-    res = model.predict(np.array([bow]))[0]
-    ERROR_THRESHOLD = 0.25
+def load_dense_layers(path=MODEL_PATH):
+    """
+    Read the Dense layers of a saved Keras model as a list of (kernel, bias, activation).
+    Handles both the HDF5 layout (Keras 2) and the zipped .keras layout (Keras 3).
+    Dropout and other weightless layers are skipped since they are no-ops at inference.
+    """
+    import io
+    import zipfile
+    import h5py
+
+    layers = []
+    if zipfile.is_zipfile(path):
+        with zipfile.ZipFile(path) as archive:
+            config = json.loads(archive.read('config.json'))
+            weights = h5py.File(io.BytesIO(archive.read('model.weights.h5')), 'r')
+        with weights:
+            for layer in config['config']['layers']:
+                if layer['class_name'] != 'Dense':
+                    continue
+                variables = weights['layers'][layer['config']['name']]['vars']
+                layers.append((np.asarray(variables['0'], dtype=np.float32),
+                               np.asarray(variables['1'], dtype=np.float32),
+                               layer['config'].get('activation', 'linear')))
+        return layers
 
-    results = [[i, r] for i, r in enumerate(res) if r > ERROR_THRESHOLD]
-    results.sort(key=lambda x: x[1], reverse=True)
+    with h5py.File(path, 'r') as model_file:
+        config = json.loads(model_file.attrs['model_config'])
+        weights = model_file['model_weights']
+        for layer in config['config']['layers']:
+            if layer['class_name'] != 'Dense':
+                continue
+            name = layer['config']['name']
+            group = weights[name][name]
+            layers.append((np.asarray(group['kernel:0'], dtype=np.float32),
+                           np.asarray(group['bias:0'], dtype=np.float32),
+                           layer['config'].get('activation', 'linear')))
+    return layers
+
+def load_keras_model(path=MODEL_PATH):
+    """
+    tf.keras load_model, also for a Keras 2 HDF5 file saved under a .keras name
+    (like model/chatbot_model.keras): Keras 3 only reads HDF5 from .h5 paths.
+    """
+    import shutil
+    import tempfile
+    import h5py
+    from tensorflow.keras.models import load_model
 
-    return_list = []
-    for r in results:
-        return_list.append({'intent': classes[r[0]], 'probability': str(r[1])})
+    if path.endswith(('.h5', '.hdf5')) or not h5py.is_hdf5(path):
+        return load_model(path)
+    with tempfile.TemporaryDirectory() as tmp:
+        alias = os.path.join(tmp, 'model.h5')
+        shutil.copyfile(path, alias)
+        return load_model(alias)
 
-    return return_list
+#---------------------------------------------
+# Model bundle (written by Model_Prep/model_bundle.py)
+#---------------------------------------------
+BUNDLE_MAGIC = b'UOKBNDL\0'
+BUNDLE_FORMAT_VERSION = 1
+BUNDLE_ALIGNMENT = 64
+
+def _align(offset, alignment=BUNDLE_ALIGNMENT):
+    return -(-offset // alignment) * alignment
+
+def load_model_bundle(path=BUNDLE_PATH, verify=False):
+    """
+    Memory-map a model bundle and return (header, layers).
+
+    The layer arrays are read-only views straight into the mapped file, so every
+    worker on a host shares the same pages and loading takes no copies.
+    With verify=True the payload is checked against the hash in the header.
+    """
+    buf = np.memmap(path, dtype=np.uint8, mode='r')
+    if bytes(buf[:8]) != BUNDLE_MAGIC:
+        raise ValueError(f"{path} is not a model bundle")
+    version, header_len = struct.unpack('<II', bytes(buf[8:16]))
+    if version != BUNDLE_FORMAT_VERSION:
+        raise ValueError(f"Unsupported model bundle version {version} in {path}")
+
+    header = json.loads(bytes(buf[16:16 + header_len]).decode('utf-8'))
+    payload_start = _align(16 + header_len, header['alignment'])
+    if verify and hashlib.sha256(buf[payload_start:]).hexdigest() != header['payload_sha256']:
+        raise ValueError(f"Model bundle {path} is corrupt (payload hash mismatch)")
+
+    def view(spec):
+        return np.ndarray(tuple(spec['shape']), dtype=header['dtype'], buffer=buf,
+                          offset=payload_start + spec['offset'])
+
+    layers = [(view(spec['kernel']), view(spec['bias']), spec['activation'])
+              for spec in header['layers']]
+    return header, layers
+
+_engine_generations = itertools.count(1)
+
+class InferenceEngine:
+    """
+    Keeps the vocab, classes and model resident for the whole process.
+
+    Vocab and classes come from the model bundle when there is one (the pickles
+    are only read as a fallback). backend='numpy' runs the forward pass over the
+    bundle's memory-mapped Dense weights (or weights pulled out of the .keras
+    file) as a few matrix multiplies, without TensorFlow; backend='keras' runs
+    model.predict on the saved model. The backend comes from UOK_INFERENCE_BACKEND,
+    defaulting to 'numpy' when a bundle exists and 'keras' otherwise.
+
+    Only the numpy backend is fork_safe: TensorFlow's thread pools do not survive a
+    fork, so a keras engine must be loaded in the process that uses it.
+    """
+    def __init__(self, backend=None, model_path=MODEL_PATH, words_path=WORDS_PATH,
+                 classes_path=CLASSES_PATH, bundle_path=BUNDLE_PATH):
+        self.backend = (backend or os.environ.get('UOK_INFERENCE_BACKEND')
+                        or ('numpy' if os.path.exists(bundle_path) else 'keras'))
+        if self.backend not in ('keras', 'numpy'):
+            raise ValueError(f"Unknown inference backend: {self.backend}")
+        self.model_path = model_path
+        self.words_path = words_path
+        self.classes_path = classes_path
+        self.bundle_path = bundle_path
+        # Identifies this engine (a reload builds a new one) for the classification cache
+        self.generation = next(_engine_generations)
+        self.version = None
+        self.featurizer = None
+        self.classes = None
+        self._model = None
+        self._layers = None
+        self._lock = threading.Lock()
+
+    @property
+    def loaded(self):
+        return self.featurizer is not None
+
+    @property
+    def fork_safe(self):
+        return self.backend == 'numpy'
+
+    def load(self):
+        """Load vocab, classes and weights once, then warm up with one forward pass."""
+        if self.loaded:
+            return self
+        with self._lock:
+            if self.loaded:
+                return self
+            layers = None
+            if os.path.exists(self.bundle_path):
+                header, layers = load_model_bundle(self.bundle_path)
+                words, classes = header['words'], header['classes']
+                self.version = header['payload_sha256'][:12]
+            else:
+                with open(self.words_path, 'rb') as f:
+                    words = pickle.load(f)
+                with open(self.classes_path, 'rb') as f:
+                    classes = pickle.load(f)
+
+            if self.backend == 'numpy':
+                self._layers = layers if layers is not None else load_dense_layers(self.model_path)
+            else:
+                self._model = load_keras_model(self.model_path)
+
+            self.classes = classes
+            self.featurizer = BagOfWords(words)
+            self.predict_proba(np.zeros((1, len(words)), dtype=np.float32))
+        return self
+
+    def predict_proba(self, bags):
+        """Class probabilities for a (N x len(words)) matrix of bags of words."""
+        bags = np.asarray(bags, dtype=np.float32)
+        if self.backend == 'numpy':
+            x = bags
+            for kernel, bias, activation in self._layers:
+                x = _ACTIVATIONS[activation](x @ kernel + bias)
+            return x
+        return self._model.predict(bags, verbose=0)
+
+    def predict_batch(self, sentences, threshold=ERROR_THRESHOLD, tokenized=False):
+        """One forward pass for many sentences; a predict() style list per sentence."""
+        self.load()
+        bags = self.featurizer.transform_batch(sentences, tokenized=tokenized)
+        probs = self.predict_proba(bags)
+        # A sentence with no vocab words is an all-zero bag; whatever the model says for it is noise
+        return [self._rank(res, threshold) if bag.any() else [] for bag, res in zip(bags, probs)]
+
+    def predict(self, sentence, threshold=ERROR_THRESHOLD):
+        """[{'intent': tag, 'probability': str}, ...] above threshold, best first."""
+        return self.predict_batch([sentence], threshold)[0]
+
+    def _rank(self, res, threshold):
+        results = [[i, r] for i, r in enumerate(res) if r > threshold]
+        results.sort(key=lambda x: x[1], reverse=True)
+
+        return [{'intent': self.classes[i], 'probability': str(r)} for i, r in results]
+
+inference_engine = InferenceEngine()
+
+def check_backend_parity(sentences, atol=1e-5, tokenized=False):
+    """
+    Run sentences (or token lists, with tokenized=True) through both backends and
+    return the largest absolute difference between their probabilities.
+    Raises AssertionError if it exceeds atol.
+    """
+    keras_engine = InferenceEngine('keras').load()
+    numpy_engine = InferenceEngine('numpy').load()
+
+    bags = keras_engine.featurizer.transform_batch(sentences, tokenized=tokenized)
+    diff = float(np.abs(keras_engine.predict_proba(bags) - numpy_engine.predict_proba(bags)).max())
+    assert diff <= atol, f"NumPy backend differs from Keras by {diff} (atol={atol})"
+    return diff
+
+#---------------------------------------------
+# Micro-batching of concurrent classifications
+#---------------------------------------------
+class MicroBatcher:
+    """
+    Coalesces concurrent calls into one batched call.
+
+    Callers block in submit() while a worker thread gathers requests for up to
+    max_wait_ms after the first one arrived (or until max_batch_size are waiting),
+    runs batch_fn once over all of them and hands every caller its own result.
+    batch_fn takes a list of items and returns a list of results in the same order.
+    """
+    def __init__(self, batch_fn, max_batch_size=32, max_wait_ms=2.0, recent=1024):
+        self.batch_fn = batch_fn
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, float(max_wait_ms)) / 1000
+        self._lock = threading.Lock()
+        self._pid = None
+        self._queue = None
+        self._batch_sizes = Counter()
+        self._waits = deque(maxlen=recent)
+        self._items = 0
+
+    def start(self):
+        self._ensure_worker()
+
+    def _ensure_worker(self):
+        # The worker thread does not survive a fork, so each process starts its own
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._queue = queue.Queue()
+            threading.Thread(target=self._run, args=(self._queue,), daemon=True,
+                             name='micro-batcher').start()
+            self._pid = os.getpid()
+
+    def submit(self, item, timeout=None):
+        self._ensure_worker()
+        future = Future()
+        self._queue.put((item, future, time.perf_counter()))
+        return future.result(timeout)
+
+    def _run(self, requests):
+        while True:
+            batch = [requests.get()]
+            deadline = batch[0][2] + self.max_wait
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.perf_counter()
+                try:
+                    batch.append(requests.get(timeout=remaining) if remaining > 0 else requests.get_nowait())
+                except queue.Empty:
+                    break
+
+            started = time.perf_counter()
+            with self._lock:
+                self._batch_sizes[len(batch)] += 1
+                self._items += len(batch)
+                self._waits.extend(started - enqueued for _, _, enqueued in batch)
+
+            try:
+                results = self.batch_fn([item for item, _, _ in batch])
+            except Exception as e:
+                for _, future, _ in batch:
+                    future.set_exception(e)
+                continue
+            for (_, future, _), result in zip(batch, results):
+                future.set_result(result)
+
+    def stats(self):
+        with self._lock:
+            waits = sorted(self._waits)
+            batches = sum(self._batch_sizes.values())
+            sizes = dict(sorted(self._batch_sizes.items()))
+            items = self._items
+
+        def percentile(p):
+            return round(waits[min(len(waits) - 1, int(p * len(waits)))] * 1000, 3) if waits else 0.0
+
+        return {
+            'batches': batches,
+            'items': items,
+            'avg_batch_size': round(items / batches, 2) if batches else 0.0,
+            'max_batch_size': max(sizes) if sizes else 0,
+            'batch_size_histogram': sizes,
+            'queue_wait_ms': {'p50': percentile(0.50), 'p99': percentile(0.99),
+                              'max': percentile(1.0)},
+            'queue_depth': self._queue.qsize() if self._queue is not None else 0,
+        }
+
+#---------------------------------------------
+# Classification cache
+#---------------------------------------------
+class ClassificationCache:
+    """
+    Bounded LRU cache of classification results, keyed on normalized utterances.
+
+    Values are (intent, confidence). Entries belong to a generation, from the
+    generation callable: the version of whatever computed them (intents.json and
+    the loaded model, see chatbot_generation). The whole cache is dropped when the
+    generation moves, and callers pass put() the generation they read before
+    computing, so a result that raced a reload is ignored instead of cached.
+    """
+    def __init__(self, maxsize=4096, generation=lambda: None):
+        self.maxsize = maxsize
+        self._current_generation = generation
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self._generation = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self.stale_puts = 0
+
+    def generation(self):
+        return self._current_generation()
+
+    def _sync(self, current):
+        if current != self._generation:
+            if self._data:
+                self.invalidations += 1
+            self._data.clear()
+            self._generation = current
+
+    def get(self, key):
+        current = self.generation()
+        with self._lock:
+            self._sync(current)
+            value = self._data.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value, generation):
+        current = self.generation()
+        with self._lock:
+            self._sync(current)
+            if generation != current:
+                self.stale_puts += 1
+                return
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._data),
+                'maxsize': self.maxsize,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations,
+                'stale_puts': self.stale_puts,
+                'generation': self._generation,
+            }
+
+def chatbot_generation():
+    """
+    (intents.json version, loaded model generation). The model part only moves
+    when reload_chatbot swaps the engine, not when the files change on disk, so
+    cached model results always match the model that is actually serving.
+    """
+    return (intent_matcher.version(), inference_engine.generation)
+
+classification_cache = ClassificationCache(
+    maxsize=int(os.environ.get('UOK_CLASSIFY_CACHE_SIZE', 4096)),
+    generation=chatbot_generation,
+)
+
+classify_batcher = MicroBatcher(
+    lambda token_lists: inference_engine.predict_batch(token_lists, tokenized=True),
+    max_batch_size=int(os.environ.get('UOK_BATCH_MAX_SIZE', 32)),
+    max_wait_ms=float(os.environ.get('UOK_BATCH_WINDOW_MS', 2)),
+)
+
+#---------------------------------------------
+# Process lifecycle (preload / fork / reload)
+#---------------------------------------------
+MODEL_ARTIFACTS = (INTENTS_PATH, MODEL_PATH, BUNDLE_PATH)
+
+def artifacts_signature():
+    """mtimes of the files the chatbot is built from; changes when any of them is replaced."""
+    signature = []
+    for path in MODEL_ARTIFACTS:
+        try:
+            signature.append(os.stat(path).st_mtime_ns)
+        except OSError:
+            signature.append(None)
+    return tuple(signature)
+
+def preload_chatbot():
+    """
+    Build the intent index and load the model, e.g. in a server's master before forking.
+    A keras engine is left unloaded (TensorFlow is not fork-safe); after_fork loads it.
+    """
+    intent_matcher.index()
+    if inference_engine.fork_safe:
+        inference_engine.load()
+
+def reload_chatbot():
+    """Swap in a freshly loaded model after its artifacts changed on disk."""
+    global inference_engine
+    engine = InferenceEngine()
+    if engine.fork_safe:
+        engine.load()
+    # Moves chatbot_generation(), which drops the classification cache
+    inference_engine = engine
+    intent_matcher.index()
+
+def after_fork():
+    """Per-worker setup after forking: threads and connections are not inherited."""
+    _current_pool()
+    classify_batcher.start()
+    message_writer.start()
+    if not inference_engine.loaded:
+        # A keras engine is loaded here, in the worker; until it is ready, classify
+        # calls wait on the engine's load lock
+        threading.Thread(target=inference_engine.load, daemon=True, name='model-loader').start()
+
+def predict_class(sentence):
+    # Keyed on the text itself so a repeated question skips tokenizing as well. Only
+    # whitespace is collapsed, not case: the vocab in words.pkl is case-sensitive
+    # ('Hello' is in it, 'hello' is not), so case changes what the model sees
+    utterance = ' '.join(sentence.split())
+    key = ('model', utterance)
+    generation = classification_cache.generation()
+    cached = classification_cache.get(key)
+    if cached is not None:
+        return [{'intent': intent, 'probability': probability} for intent, probability in cached]
+
+    results = classify_batcher.submit(clean_up_sentence(utterance))
+    classification_cache.put(key, tuple((r['intent'], r['probability']) for r in results), generation)
+    return results
 
 def get_response(intents_list):
-    intents_json = json.load(open('model/intents.json'))
-    tag = intents_list[0]['intent']
-    list_of_intents = intents_json['intents']
-    for i in list_of_intents:
-        if i['tag'] == tag:
-            result = random.choice(i['responses'])
-            break
-    return result
+    responses = intent_matcher.responses()
+    if not intents_list or intents_list[0]['intent'] not in responses:
+        return random.choice(FALLBACK_RESPONSES)
+    return random.choice(responses[intents_list[0]['intent']])
+
+#---------------------------------------------
+# Tiered intent pipeline
+#---------------------------------------------
+class IntentPipeline:
+    """
+    Routes a message through the cheapest tier that can answer it:
+
+      1. 'pattern'  - compiled pattern match over intents.json
+      2. 'model'    - neural classifier, only run when the patterns miss; its best
+                      intent is used if it clears ERROR_THRESHOLD and intents.json
+                      has responses for it
+      3. 'fallback' - the generic fallback responses
+
+    Keeps per-tier run/hit counters and timings. A model tier failure falls through
+    to 'fallback'; it is counted and logged with its traceback, at most once every
+    log_interval seconds so a broken model does not flood the log.
+    """
+    TIERS = ('pattern', 'model', 'fallback')
+
+    def __init__(self, use_model=True, log_interval=60.0):
+        self.use_model = use_model
+        self.log_interval = log_interval
+        self.logger = logging.getLogger(__name__)
+        self._lock = threading.Lock()
+        self._stats = {tier: {'runs': 0, 'hits': 0, 'errors': 0, 'time': 0.0} for tier in self.TIERS}
+        self._last_logged = None
+        self._unlogged_errors = 0
+
+    def _log_model_error(self):
+        now = time.monotonic()
+        with self._lock:
+            if self._last_logged is not None and now - self._last_logged < self.log_interval:
+                self._unlogged_errors += 1
+                return
+            self._last_logged = now
+            suppressed, self._unlogged_errors = self._unlogged_errors, 0
+        self.logger.exception("Model tier failed, using the fallback (%d earlier failures not logged)",
+                              suppressed)
+
+    def _record(self, tier, started, hit, error=False):
+        elapsed = time.perf_counter() - started
+        with self._lock:
+            stats = self._stats[tier]
+            stats['runs'] += 1
+            stats['hits'] += hit
+            stats['errors'] += error
+            stats['time'] += elapsed
+
+    def _classify(self, text):
+        started = time.perf_counter()
+        tag = match_intent(text)
+        self._record('pattern', started, tag is not None)
+        if tag is not None:
+            return 'pattern', tag, 1.0
+
+        if self.use_model:
+            started = time.perf_counter()
+            try:
+                results = predict_class(text)
+            except Exception:
+                self._record('model', started, False, error=True)
+                self._log_model_error()
+            else:
+                responses = intent_matcher.responses()
+                hit = bool(results) and results[0]['intent'] in responses
+                self._record('model', started, hit)
+                if hit:
+                    return 'model', results[0]['intent'], float(results[0]['probability'])
+
+        return 'fallback', None, 0.0
+
+    def route(self, text):
+        """{'tier', 'intent', 'confidence', 'response'} for a user message."""
+        tier, intent, confidence = self._classify(text)
+        if tier == 'fallback':
+            started = time.perf_counter()
+            response = random.choice(FALLBACK_RESPONSES)
+            self._record('fallback', started, True)
+        else:
+            response = random.choice(intent_matcher.responses()[intent])
+        return {'tier': tier, 'intent': intent, 'confidence': confidence, 'response': response}
+
+    def stats(self):
+        with self._lock:
+            return {
+                tier: {
+                    'runs': stats['runs'],
+                    'hits': stats['hits'],
+                    'errors': stats['errors'],
+                    'avg_ms': round(stats['time'] * 1000 / stats['runs'], 3) if stats['runs'] else 0.0,
+                }
+                for tier, stats in self._stats.items()
+            }
+
+chat_pipeline = IntentPipeline(use_model=os.environ.get('UOK_NEURAL_FALLBACK', '1') == '1')
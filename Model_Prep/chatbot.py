@@ -17,6 +17,9 @@ words = pickle.load(open('model/words.pkl', 'rb'))
 classes = pickle.load(open('model/classes.pkl', 'rb'))
 model = load_model('model/chatbot_model.keras')
 
+# word -> position in the bag of words
+word_index = {word: i for i, word in enumerate(words)}
+
 
 def clean_up_sentence(sentence):
     """Tokenizes and lemmatizes the input sentence"""
@@ -28,12 +31,9 @@ def clean_up_sentence(sentence):
 def bag_of_words(sentence):
     """Converts a sentence into a bag of words vector"""
     sentence_words = clean_up_sentence(sentence)
-    bag = [0] * len(words)
-    for w in sentence_words:
-        for i, word in enumerate(words):
-            if word == w:
-                bag[i] = 1
-    return np.array(bag)
+    bag = np.zeros(len(words), dtype=np.float32)
+    bag[[word_index[w] for w in sentence_words if w in word_index]] = 1
+    return bag
 
 
 def predict_class(sentence):
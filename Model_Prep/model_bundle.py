@@ -0,0 +1,69 @@
+"""
+Single-file model bundle used for serving.
+
+Layout (integers are little-endian):
+    8 bytes   magic b'UOKBNDL\0'
+    4 bytes   format version (uint32)
+    4 bytes   header length in bytes (uint32)
+    header    UTF-8 JSON: words, classes, layer specs and the payload hash
+    payload   float32 arrays, each starting on a 64-byte boundary
+
+This is the only writer of the format: model_training.py and the app's
+`flask export-bundle` both use write_bundle. The serving side reads it with
+load_model_bundle in 'Flask WebApp/utils.py', so format changes go in both.
+"""
+import os
+import json
+import struct
+import hashlib
+from datetime import datetime, timezone
+
+import numpy as np
+
+MAGIC = b'UOKBNDL\0'
+FORMAT_VERSION = 1
+ALIGNMENT = 64
+
+
+def _align(offset):
+    return -(-offset // ALIGNMENT) * ALIGNMENT
+
+
+def write_bundle(path, words, classes, layers):
+    """Write words, classes and the Dense layers [(kernel, bias, activation), ...] to path"""
+    arrays = []
+    specs = []
+    offset = 0
+    for kernel, bias, activation in layers:
+        spec = {'activation': activation}
+        for name, array in (('kernel', kernel), ('bias', bias)):
+            array = np.ascontiguousarray(array, dtype='<f4')
+            offset = _align(offset)
+            spec[name] = {'offset': offset, 'shape': list(array.shape)}
+            arrays.append((offset, array))
+            offset += array.nbytes
+        specs.append(spec)
+
+    payload = bytearray(offset)
+    for start, array in arrays:
+        payload[start:start + array.nbytes] = array.tobytes()
+
+    header = json.dumps({
+        'format_version': FORMAT_VERSION,
+        'created_at': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'dtype': '<f4',
+        'alignment': ALIGNMENT,
+        'payload_sha256': hashlib.sha256(payload).hexdigest(),
+        'words': list(words),
+        'classes': list(classes),
+        'layers': specs,
+    }).encode('utf-8')
+
+    prefix = MAGIC + struct.pack('<II', FORMAT_VERSION, len(header)) + header
+    padding = b'\0' * (_align(len(prefix)) - len(prefix))
+
+    # Write next to the target and swap it in, so a server never maps a half-written file
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(prefix + padding + payload)
+    os.replace(tmp_path, path)
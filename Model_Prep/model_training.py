@@ -9,6 +9,7 @@ from tensorflow.keras.models import Sequential
 from tensorflow.keras.layers import Dense, Activation, Dropout
 from tensorflow.keras.optimizers import SGD
 from tensorflow.keras import regularizers  # Import regularizer for weight decay
+from model_bundle import write_bundle
 
 os.environ["CUDA_VISIBLE_DEVICES"] = "-1"  # Disable GPU
 
@@ -117,3 +118,8 @@ model.fit(np.array(train_x), np.array(train_y), epochs=200, batch_size=5, verbos
 
 # Save the trained model
 model.save('model/chatbot_model.keras')
+
+# Export the single-file serving bundle (vocab, classes and Dense weights)
+dense_layers = [(*layer.get_weights(), layer.get_config()['activation'])
+                for layer in model.layers if isinstance(layer, Dense)]
+write_bundle('model/chatbot_bundle.bin', words, classes, dense_layers)